@@ -0,0 +1,217 @@
+# bench.py — bot.py 핵심 경로 오프라인 벤치마크 (디스코드 접속 없음)
+# 사용 예:
+#   python bench.py                                   # 기본 규모
+#   python bench.py --users 10,100,1000,5000 --weeks 3,52,156 --out bench_results.json
+#   python bench.py --compare bench_results.json       # 이전 결과와 비교, 느려졌으면 종료코드 1
+import os, sys, json, time, random, argparse, platform, tempfile, tracemalloc
+from datetime import datetime, timezone, timedelta
+
+def parse_args():
+    p = argparse.ArgumentParser(description="StudyBot 집계/저장/정리 벤치마크")
+    p.add_argument("--users", default="10,100,1000,5000", help="유저 수 목록(쉼표)")
+    p.add_argument("--weeks", default="3,52", help="기록 기간(주) 목록(쉼표)")
+    p.add_argument("--sessions-per-day", type=float, default=1.0, help="유저당 하루 평균 세션 수")
+    p.add_argument("--live-ratio", type=float, default=0.05, help="진행중 타이머 비율")
+    p.add_argument("--queries", type=int, default=2000, help="sum_seconds_in_range 호출 횟수")
+    p.add_argument("--max-sessions", type=int, default=2_000_000, help="이보다 큰 조합은 건너뜀")
+    p.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default="bench_results.json")
+    p.add_argument("--compare", help="비교할 이전 결과 파일")
+    p.add_argument("--threshold", type=float, default=1.25, help="이 배율 이상 느려지면 회귀로 판단")
+    return p.parse_args()
+
+args = parse_args()
+
+# bot을 불러오기 전에 데이터 폴더/저장 방식을 정해야 함
+DATA_DIR = tempfile.mkdtemp(prefix="studybot-bench-")
+os.environ["DATA_DIR"] = DATA_DIR
+os.environ["STORAGE_BACKEND"] = args.backend
+os.environ.setdefault("PERSIST_COALESCE_SECONDS", "0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bot  # noqa: E402
+P = bot.get_partition(None)  # 기본 파티션(DATA_DIR 바로 아래). sqlite면 빈 JSON → SQLite 이전도 여기서 끝남
+
+# ---------------- 합성 데이터 ----------------
+def reset_state():
+    bot.persist.flush()
+    P.records.clear(); P.rollup.clear(); bot.timers.clear()
+    P.gen = 0
+    P.board = bot.Leaderboard()
+    bot.result_cache.clear()
+    if P.sql:
+        with P.sql.conn:
+            P.sql.conn.execute("DELETE FROM sessions")
+    for name in os.listdir(DATA_DIR):
+        if name.startswith(("records.json", "records.log", "rollup.json")):
+            os.remove(os.path.join(DATA_DIR, name))
+
+def generate(n_users: int, weeks: int, rng: random.Random) -> int:
+    """유저별로 weeks주 동안 겹치지 않는 세션(epoch 초)을 만들고 records/rollup(또는 DB)에 채움."""
+    now_dt = datetime.now(timezone.utc)
+    now = now_dt.timestamp()
+    first = now - weeks * 7 * 86400
+    gap_mean = 86400.0 / max(args.sessions_per_day, 0.01)
+    total = 0
+    rows = []
+    for uid in range(1, n_users + 1):
+        t = first + rng.uniform(0, gap_mean)
+        sessions = []
+        while True:
+            dur = rng.uniform(60, 4 * 3600)
+            if t + dur >= now - 300: break
+            sessions.append((t, t + dur))
+            t = t + dur + rng.expovariate(1.0 / gap_mean)
+        total += len(sessions)
+        if P.sql:
+            rows.extend((uid, s, e) for s, e in sessions)
+        else:
+            P.records[uid] = bot.SessionIndex(sessions)
+        if rng.random() < args.live_ratio:
+            bot.timers[(P.key, uid)] = {"start": now_dt - timedelta(seconds=rng.uniform(60, 3 * 3600)),
+                               "message": None, "mention": f"<@{uid}>", "avatar": None}
+    if P.sql:
+        with P.sql.conn:
+            P.sql.conn.executemany("INSERT OR IGNORE INTO sessions(uid,start,end) VALUES(?,?,?)", rows)
+    else:
+        bot.rebuild_rollup(P)
+    bot.rebuild_leaderboard(P)
+    return total
+
+# ---------------- 측정 ----------------
+def measure(fn, setup=None):
+    """벽시계 시간(초)과 tracemalloc 최대 메모리(KB).
+    tracemalloc은 실행을 크게 느리게 하므로 시간과 메모리는 따로 한 번씩 잰다."""
+    if setup: setup()
+    t0 = time.perf_counter()
+    fn()
+    wall = time.perf_counter() - t0
+    if setup: setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return wall, peak / 1024.0
+
+def snapshot_state():
+    """정리처럼 상태를 바꾸는 측정을 두 번 돌리기 위해 현재 기록을 복사해 두고 복원 함수를 돌려줌."""
+    if P.sql:
+        rows = P.sql.conn.execute("SELECT uid,start,end FROM sessions").fetchall()
+        def restore():
+            bot.persist.flush()
+            with P.sql.conn:
+                P.sql.conn.execute("DELETE FROM sessions")
+                P.sql.conn.executemany("INSERT INTO sessions(uid,start,end) VALUES(?,?,?)", rows)
+            bot.rebuild_leaderboard(P)
+        return restore
+    saved = {uid: list(idx) for uid, idx in P.records.items()}
+    days = {uid: dict(d) for uid, d in P.rollup.items()}
+    def restore():
+        bot.persist.flush()
+        P.records.clear(); P.rollup.clear(); bot.result_cache.clear()
+        for uid, lst in saved.items(): P.records[uid] = bot.SessionIndex(lst)
+        for uid, d in days.items(): P.rollup[uid] = dict(d)
+        bot.rebuild_leaderboard(P)
+    return restore
+
+def run_scenario(n_users: int, weeks: int, rng: random.Random):
+    reset_state()
+    t0 = time.perf_counter()
+    n_sessions = generate(n_users, weeks, rng)
+    print(f"· users={n_users} weeks={weeks} sessions={n_sessions} (생성 {time.perf_counter()-t0:.1f}s)")
+    base = {"users": n_users, "weeks": weeks, "sessions": n_sessions, "backend": args.backend}
+    out = []
+
+    def add(op, wall, peak, calls=1):
+        row = dict(base, op=op, wall_s=round(wall, 6), per_call_s=round(wall / calls, 9),
+                   peak_kb=round(peak, 1), calls=calls)
+        out.append(row)
+        print(f"    {op:<22} {wall*1000:10.2f} ms  ({wall/calls*1e6:9.1f} µs/call)  peak {peak:10.1f} KB")
+
+    # sum_seconds_in_range: 임의 유저 × 임의 주
+    ws, _ = bot.week_bounds_local_monday_to_sunday()
+    qs = []
+    for _ in range(args.queries):
+        s = ws - timedelta(weeks=rng.randint(0, max(weeks - 1, 0)), days=rng.randint(0, 6))
+        qs.append((rng.randint(1, n_users), s, s + timedelta(days=rng.choice((1, 7)))))
+    def q():
+        for uid, s, e in qs: bot.sum_seconds_in_range(P, uid, s, e)
+    add("sum_seconds_in_range", *measure(q), calls=len(qs))
+
+    # /주간일람 집계(이번 주 / 지난 주). 캐시를 비우고 재는 첫 조회와, 같은 조회를 반복할 때(캐시 적중)
+    clear = bot.result_cache.clear
+    add("roster_this_week", *measure(lambda: bot.roster_daily_totals(P, ws, 7), setup=clear))
+    add("roster_last_week", *measure(lambda: bot.roster_daily_totals(P, ws - timedelta(days=7), 7), setup=clear))
+    bot.roster_daily_totals(P, ws - timedelta(days=7), 7)
+    add("roster_last_week_cached", *measure(lambda: bot.roster_daily_totals(P, ws - timedelta(days=7), 7)))
+
+    # /랭킹 (이번 주 상위 10명, 진행중 포함)
+    add("leaderboard_week_top10", *measure(lambda: bot.leaderboard_page(P, "week", 0, 10)))
+
+    # 스냅샷 저장(저장 스레드 완료까지) / 로드
+    def save():
+        bot.save_records(P); bot.persist.flush()
+    add("save_records", *measure(save))
+    def load():
+        P.records.clear(); P.rollup.clear()
+        bot.load_records(P)
+    add("load_records", *measure(load))
+
+    # 화요일 정리 본체(저장 포함)
+    cutoff = bot.keep_from_monday_after_3_weeks_ago_sunday_local()
+    def prune():
+        bot.run_prune(P, cutoff); bot.persist.flush()
+    add("prune", *measure(prune, setup=snapshot_state()))
+    return out
+
+# ---------------- 비교 ----------------
+def compare(old_path: str, new_rows) -> int:
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)["results"]
+    key = lambda r: (r["backend"], r["users"], r["weeks"], r["op"])
+    prev = {key(r): r for r in old}
+    bad = 0
+    print(f"\n비교 대상: {old_path} (임계 {args.threshold:.2f}x)")
+    for r in new_rows:
+        p = prev.get(key(r))
+        if not p or p["wall_s"] <= 0: continue
+        ratio = r["wall_s"] / p["wall_s"]
+        flag = "⚠️ 회귀" if ratio >= args.threshold else ""
+        if flag: bad += 1
+        print(f"  {r['users']:>5}u {r['weeks']:>4}w {r['op']:<22} {p['wall_s']*1000:9.2f} → {r['wall_s']*1000:9.2f} ms  x{ratio:5.2f} {flag}")
+    return 1 if bad else 0
+
+def main() -> int:
+    rng = random.Random(args.seed)
+    users = [int(x) for x in args.users.split(",") if x.strip()]
+    weeks = [int(x) for x in args.weeks.split(",") if x.strip()]
+    results = []
+    for w in weeks:
+        for u in users:
+            est = int(u * w * 7 * args.sessions_per_day)
+            if est > args.max_sessions:
+                print(f"· users={u} weeks={w} 건너뜀 (예상 세션 {est} > --max-sessions)")
+                continue
+            results.extend(run_scenario(u, w, rng))
+    reset_state()
+    bot.persist.close()
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": getattr(bot.np, "__version__", None),
+            "backend": args.backend,
+            "seed": args.seed,
+            "sessions_per_day": args.sessions_per_day,
+        },
+        "results": results,
+    }
+    rc = compare(args.compare, results) if args.compare else 0
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 결과 저장: {args.out}")
+    return rc
+
+if __name__ == "__main__":
+    sys.exit(main())
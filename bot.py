@@ -1,10 +1,23 @@
 # bot.py — 화면공유 자동 타이머(1분 미만 제외) + 주간 일람(전원)
 # Python 3.10+
-import os, json, discord
+import os, sys, json, gzip, shutil, hashlib, argparse, tempfile, asyncio, time, threading, sqlite3, logging, discord
+from array import array
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from discord import app_commands
 from discord.ext import commands, tasks
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
-from typing import Dict, List, Tuple, Optional, Literal
+from typing import Dict, List, Tuple, Optional, Literal, Callable, Iterator, Iterable
+try:
+    import numpy as np  # 있으면 주간일람 집계를 벡터화, 없으면 순수 파이썬으로 계산
+except ImportError:
+    np = None
+try:
+    import fcntl  # 여러 프로세스가 autotrack.json을 함께 쓸 때 잠금(없는 OS에선 생략)
+except ImportError:
+    fcntl = None
 
 # ---------------- 설정 ----------------
 load_dotenv()
@@ -12,27 +25,97 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 GUILD_IDS = [int(x) for x in os.getenv("GUILD_IDS","").split(",") if x.strip()]
 STREAM_LOG_CHANNEL_ID = int(os.getenv("STREAM_LOG_CHANNEL_ID","0"))
 DATA_DIR = os.getenv("DATA_DIR","./data")
-RECORDS_JSON = os.path.join(DATA_DIR,"records.json")
-RUNNING_JSON = os.path.join(DATA_DIR,"running.json")
+# 저장 방식: json(기본) | sqlite — sqlite면 파티션마다 세션/진행중을 records.db 한 파일에 보관
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND","json").strip().lower()
+USE_SQLITE = STORAGE_BACKEND == "sqlite"
+COMPACT_LOG_BYTES = int(os.getenv("COMPACT_LOG_BYTES", str(256*1024)))
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# --- 계정별 자동기록 스위치 저장 경로 ---
+def _parse_id_ranges(raw:str)->List[int]:
+    # "0-3,6" → [0,1,2,3,6]
+    out=[]
+    for part in raw.split(","):
+        part=part.strip()
+        if not part: continue
+        if "-" in part:
+            a,b=part.split("-",1); out.extend(range(int(a),int(b)+1))
+        else:
+            out.append(int(part))
+    return out
+
+# 샤딩: SHARD_COUNT를 주면 AutoShardedBot으로 실행. SHARD_IDS("0-3" 또는 "0,2")가 있으면 그 샤드만 맡음
+# → 샤드 범위가 다른 여러 프로세스가 같은 DATA_DIR을 함께 쓸 수 있음
+SHARD_COUNT = int(os.getenv("SHARD_COUNT","0"))
+SHARD_IDS = _parse_id_ranges(os.getenv("SHARD_IDS",""))
+# 길드별 상태 분할: 타이머/기록을 (길드, 유저)로 나누고 길드마다 DATA_DIR/guilds/<길드ID>/ 에 저장 (샤딩이면 항상 켜짐)
+PARTITION_BY_GUILD = SHARD_COUNT > 0 or os.getenv("PARTITION_BY_GUILD","0") == "1"
+# 분할 전 DATA_DIR 바로 아래 파일을 그대로 이어 쓸 길드 (기본: GUILD_IDS가 하나뿐이면 그 길드)
+LEGACY_GUILD_ID = int(os.getenv("LEGACY_GUILD_ID", str(GUILD_IDS[0]) if len(GUILD_IDS)==1 else "0"))
+# 길드별 로그 채널 "길드ID:채널ID,..." — 목록에 없는 길드는 STREAM_LOG_CHANNEL_ID
+STREAM_LOG_CHANNELS = {int(g):int(c) for g,c in (x.split(":",1) for x in os.getenv("STREAM_LOG_CHANNELS","").split(",") if ":" in x)}
+
+# 진행중 임베드 갱신 스케줄러: 틱 간격 / 동시 편집 수 / 채널당 5초 편집 허용량
+EDIT_TICK_SECONDS = float(os.getenv("EDIT_TICK_SECONDS","5"))
+EDIT_CONCURRENCY = int(os.getenv("EDIT_CONCURRENCY","4"))
+CHANNEL_EDITS_PER_5S = int(os.getenv("CHANNEL_EDITS_PER_5S","4"))
+# 대시보드 모드: 유저마다 시작 메시지를 보내고 고치는 대신 로그 채널마다 고정 메시지 하나에 진행중 타이머를 모아
+# 주기마다 한 번만 편집 → 인원이 늘어도 API 호출은 채널 수만큼. 종료 요약은 그대로 유저마다 전송
+LIVE_DASHBOARD = os.getenv("LIVE_DASHBOARD","0") == "1"
+DASHBOARD_INTERVAL_SECONDS = float(os.getenv("DASHBOARD_INTERVAL_SECONDS","15"))
+# 화면공유가 끊겼다가 이 시간(초) 안에 다시 켜지면 같은 타이머/메시지로 이어감. 0이면 바로 종료
+STREAM_GRACE_SECONDS = float(os.getenv("STREAM_GRACE_SECONDS","30"))
+# 진행중 타이머 저장 주기(초). 재시작 때 그사이 방송을 끝낸 유저는 마지막 저장 시각으로 종료 기록. 0이면 끔
+RUNNING_HEARTBEAT_SECONDS = float(os.getenv("RUNNING_HEARTBEAT_SECONDS","60"))
+# 백그라운드 저장: 이 시간 동안 몰린 저장 요청을 한 번의 쓰기로 합침
+PERSIST_COALESCE_SECONDS = float(os.getenv("PERSIST_COALESCE_SECONDS","0.5"))
+# 지표(프로메테우스 텍스트) HTTP 포트. 0이면 끔. 샤드 프로세스를 한 호스트에 여럿 띄우면 포트를 각각 다르게
+METRICS_PORT = int(os.getenv("METRICS_PORT","0"))
+METRICS_HOST = os.getenv("METRICS_HOST","127.0.0.1")
+# 정산/일람 집계 결과 캐시 항목 수 (LRU)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE","512"))
+# 기록 내보내기: 이 크기(바이트)를 넘으면 gzip으로 전환
+EXPORT_GZIP_BYTES = int(os.getenv("EXPORT_GZIP_BYTES", str(8*1024*1024)))
+# 음성 이벤트 기록 파일(JSONL). 지정하면 on_voice_state_update를 한 줄씩 남김 → loadtest.py --trace 로 재생
+VOICE_TRACE_PATH = os.getenv("VOICE_TRACE_PATH","")
+
+# --- 계정별 자동기록 스위치 저장 경로 (길드와 무관하게 DATA_DIR 하나를 모든 프로세스가 공유) ---
 AUTOTRACK_JSON = os.path.join(DATA_DIR, "autotrack.json")
 
 # --- 메모리 테이블: { user_id: bool }  (기본 True)
 autotrack: Dict[int, bool] = {}
+_autotrack_mtime = 0.0
 
-def save_autotrack():
+def _merge_autotrack_json(uid: int, val: bool):
+    # 다른 프로세스가 바꾼 값을 덮어쓰지 않도록 최신 파일 위에 이 유저 값만 바꿔 씀
+    lock = open(AUTOTRACK_JSON + ".lock", "a")
     try:
-        with open(AUTOTRACK_JSON, "w", encoding="utf-8") as f:
-            json.dump({str(k): v for k, v in autotrack.items()}, f, ensure_ascii=False, indent=2)
-    except:
-        pass
+        if fcntl: fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(AUTOTRACK_JSON, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            raw = {}
+        raw[str(uid)] = val
+        _atomic_write_json(AUTOTRACK_JSON, raw)
+    finally:
+        lock.close()
+
+def save_autotrack(uid: int):
+    val = autotrack[uid]
+    if USE_SQLITE:
+        persist.submit(f"autotrack:{uid}", lambda: autotrack_store().set_autotrack(uid, val))
+        return
+    persist.submit(f"autotrack:{uid}", lambda: _merge_autotrack_json(uid, val))
 
 def load_autotrack():
+    global _autotrack_mtime
     try:
-        with open(AUTOTRACK_JSON, "r", encoding="utf-8") as f:
-            raw = json.load(f)
+        if USE_SQLITE:
+            raw = autotrack_store().load_autotrack()
+        else:
+            _autotrack_mtime = os.path.getmtime(AUTOTRACK_JSON)
+            with open(AUTOTRACK_JSON, "r", encoding="utf-8") as f:
+                raw = json.load(f)
         autotrack.clear()
         for k, v in raw.items():
             autotrack[int(k)] = bool(v)
@@ -41,6 +124,119 @@ def load_autotrack():
     except:
         pass
 
+# ---------------- 계측 ----------------
+class Histogram:
+    """지연 시간(초) 히스토그램. 고정 버킷 + 합계/개수라 기록 비용이 일정하고 그대로 내보낼 수 있음."""
+    BUCKETS=(0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0)
+    __slots__=("counts","sum","count")
+
+    def __init__(self):
+        self.counts=[0]*(len(self.BUCKETS)+1); self.sum=0.0; self.count=0
+
+    def observe(self, v:float):
+        self.counts[bisect_left(self.BUCKETS,v)]+=1; self.sum+=v; self.count+=1
+
+    def merge(self, other:"Histogram"):
+        for k,c in enumerate(other.counts): self.counts[k]+=c
+        self.sum+=other.sum; self.count+=other.count
+
+    def quantile(self, q:float)->float:
+        """q 분위수가 들어 있는 버킷의 상한(마지막 버킷이면 inf)."""
+        if not self.count: return 0.0
+        acc=0
+        for k,c in enumerate(self.counts):
+            acc+=c
+            if acc>=q*self.count:
+                return self.BUCKETS[k] if k<len(self.BUCKETS) else float("inf")
+        return float("inf")
+
+class Metrics:
+    """카운터/히스토그램/게이지 모음. 저장 스레드에서도 기록하므로 잠금으로 보호.
+    게이지는 값을 들고 있지 않고 내보낼 때 함수를 불러 읽음."""
+    def __init__(self):
+        self._lock=threading.Lock()
+        self.counters: Dict[Tuple[str,Tuple],float]={}
+        self.histograms: Dict[Tuple[str,Tuple],Histogram]={}
+        self.gauges: Dict[str,Callable[[],float]]={}
+        self.started=time.time()
+
+    def inc(self, name:str, n:float=1.0, **labels):
+        k=(name,tuple(sorted(labels.items())))
+        with self._lock: self.counters[k]=self.counters.get(k,0.0)+n
+
+    def observe(self, name:str, secs:float, **labels):
+        k=(name,tuple(sorted(labels.items())))
+        with self._lock:
+            h=self.histograms.get(k)
+            if h is None: h=self.histograms[k]=Histogram()
+            h.observe(secs)
+
+    @contextmanager
+    def timer(self, name:str, **labels):
+        # async 함수 안에서도 await를 감싸 그대로 씀 (벽시계 기준)
+        t0=time.perf_counter()
+        try: yield
+        finally: self.observe(name, time.perf_counter()-t0, **labels)
+
+    def gauge(self, name:str, fn:Callable[[],float]):
+        self.gauges[name]=fn
+
+    def total(self, name:str, **labels)->float:
+        want=set(labels.items())
+        with self._lock:
+            return sum(v for (n,l),v in self.counters.items() if n==name and want<=set(l))
+
+    def merged(self, name:str, **labels)->Histogram:
+        """라벨이 일치하는 히스토그램을 하나로 합침 (라벨을 주지 않으면 전부)."""
+        want=set(labels.items()); out=Histogram()
+        with self._lock:
+            for (n,l),h in self.histograms.items():
+                if n==name and want<=set(l): out.merge(h)
+        return out
+
+    def render(self)->str:
+        """프로메테우스 텍스트 형식(0.0.4)."""
+        def lbl(pairs)->str:
+            return "{"+",".join(f'{k}="{v}"' for k,v in pairs)+"}" if pairs else ""
+        with self._lock:
+            counters=sorted(self.counters.items())
+            hists=sorted((k,list(h.counts),h.sum,h.count) for k,h in self.histograms.items())
+        lines: List[str]=[]
+        seen=set()
+        for (name,l),v in counters:
+            if name not in seen: seen.add(name); lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{lbl(l)} {v:g}")
+        for (name,l),counts,total,count in hists:
+            if name not in seen: seen.add(name); lines.append(f"# TYPE {name} histogram")
+            acc=0
+            for b,c in zip(Histogram.BUCKETS+("+Inf",),counts):
+                acc+=c
+                lines.append(f"{name}_bucket{lbl(l+(('le',b),))} {acc}")
+            lines.append(f"{name}_sum{lbl(l)} {total:.6f}")
+            lines.append(f"{name}_count{lbl(l)} {count}")
+        for name,fn in sorted(self.gauges.items()):
+            try: v=float(fn())
+            except Exception: continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {v:g}")
+        return "\n".join(lines)+"\n"
+
+metrics = Metrics()
+
+class RateLimitLogCounter(logging.Handler):
+    """discord.py는 429를 HTTP 클라이언트 안에서 기다렸다 재시도하고 경고 로그만 남김(재시도가 다 떨어져야 예외)
+    → 429 한 번마다 한 줄씩 남는 "responded with 429" 경고만 세서 실제로 받은 429 횟수로 씀.
+    전역 한도면 바로 뒤에 "Global rate limit" 경고가 한 줄 더 오는데, 같은 429라 합계에는 넣지 않고
+    studybot_rate_limited_global_total(부분 집합)로만 셈. 우리 코드까지 올라온 429는 studybot_rate_limit_errors_total."""
+    def emit(self, record: logging.LogRecord):
+        msg=str(record.msg)
+        if "responded with 429" in msg:
+            metrics.inc("studybot_rate_limited_total")
+        elif "Global rate limit has been hit" in msg:
+            metrics.inc("studybot_rate_limited_global_total")
+
+logging.getLogger("discord.http").addHandler(RateLimitLogCounter(logging.WARNING))
+
 # ---------------- 시간 유틸 ----------------
 KOR_WD = ["월","화","수","목","금","토","일"]
 
@@ -79,62 +275,1082 @@ def hms_from_seconds(secs: float):
 def fmt_hms(secs: float) -> str:
     h,m,s = hms_from_seconds(secs); return f"{h:02d}:{m:02d}:{s:02d}"
 
-def sum_seconds_in_range(uid: int, rs_local: datetime, re_local: datetime) -> float:
-    def overlap(a1,a2,b1,b2):
-        s=max(a1,b1); e=min(a2,b2); return max(0.0,(e-s).total_seconds())
-    total=0.0
-    for s_utc,e_utc in records.get(uid,[]):
-        s=s_utc.astimezone(); e=e_utc.astimezone()
-        total += overlap(s,e,rs_local,re_local)
-    if uid in timers:
-        s = timers[uid]["start"].astimezone()
-        now = datetime.now(timezone.utc).astimezone()
-        total += overlap(s,now,rs_local,re_local)
-    return total
+def overlap_seconds(a1:datetime, a2:datetime, b1:datetime, b2:datetime) -> float:
+    s=max(a1,b1); e=min(a2,b2); return max(0.0,(e-s).total_seconds())
 
-def sum_seconds_in_single_day(uid:int, day_start_local:datetime)->float:
-    return sum_seconds_in_range(uid, day_start_local, day_start_local+timedelta(days=1))
+def live_end(st: Dict, now: datetime) -> datetime:
+    # 끊긴 채 유예 중인 타이머는 끊긴 시각까지만 셈 (다시 켜지면 그때부터 다시 늘어남)
+    return st.get("paused_at") or now
+
+def live_seconds_in_range(part: "Partition", uid: int, rs_local: datetime, re_local: datetime) -> float:
+    st = timers.get((part.key, uid))
+    if not st: return 0.0
+    return overlap_seconds(st["start"], live_end(st, datetime.now(timezone.utc)), rs_local, re_local)
+
+def sum_seconds_in_range(part: "Partition", uid: int, rs_local: datetime, re_local: datetime) -> float:
+    if part.sql:
+        total=part.sql.sum_range(uid,rs_local,re_local)
+    else:
+        idx=part.records.get(uid)
+        total=idx.sum_range(rs_local.timestamp(),re_local.timestamp()) if idx else 0.0
+    return total + live_seconds_in_range(part, uid, rs_local, re_local)
+
+def day_bounds(day_start_local: datetime, n_days: int) -> List[datetime]:
+    return [day_start_local+timedelta(days=k) for k in range(n_days+1)]
+
+class ResultCache:
+    """집계 결과 LRU. 키에 데이터 버전이 들어 있어 따로 무효화하지 않음 — 옛 버전 항목은 밀려나며 사라짐.
+    저장된 값은 호출한 쪽에서 고치지 않도록 꺼낼 때 복사해서 씀."""
+    _MISS=object()
+
+    def __init__(self, size:int):
+        self.size=size
+        self._d: "OrderedDict[tuple, object]"=OrderedDict()
+
+    def __len__(self): return len(self._d)
+    def clear(self): self._d.clear()
+
+    def get(self, key:tuple, compute:Callable[[],object]):
+        v=self._d.get(key, self._MISS)
+        if v is not self._MISS:
+            self._d.move_to_end(key)
+            metrics.inc("studybot_result_cache_total", result="hit")
+            return v
+        metrics.inc("studybot_result_cache_total", result="miss")
+        v=compute()
+        if self.size>0:
+            self._d[key]=v
+            while len(self._d)>self.size: self._d.popitem(last=False)
+        return v
+
+result_cache = ResultCache(RESULT_CACHE_SIZE)
+
+def data_version(part: "Partition", end_ts: float, uid: Optional[int] = None) -> tuple:
+    """end_ts에서 끝나는 기간의 종료 세션 합계가 의존하는 데이터 버전.
+    이미 끝난 기간이고 그 전에 시작한 진행중 타이머가 없으면 이후 세션 종료로는 바뀔 수 없으므로
+    정리 때만 올라가는 버전을 씀 → 지난 기간은 LRU에서 밀려날 때까지 계속 재사용."""
+    if end_ts<=time.time():
+        if uid is not None:
+            st=timers.get((part.key,uid))
+            open_=st is not None and st["start"].timestamp()<end_ts
+        else:
+            open_=any(k==part.key and st["start"].timestamp()<end_ts for (k,_),st in timers.items())
+        if not open_:
+            # sqlite 정리는 저장 스레드에서 나중에 반영되므로 그 완료 횟수도 키에 넣음
+            return ("closed", part.prune_version, part.sql.pruned if part.sql else 0)
+    return ("live", part.version, part.sql.pruned if part.sql else 0)
+
+def _closed_seconds_by_days(part: "Partition", uid: int, day_start_local: datetime, n_days: int) -> List[float]:
+    if part.sql:
+        return part.sql.bucket_sums(day_bounds(day_start_local,n_days),uid).get(uid,[0.0]*n_days)
+    days=part.rollup.get(uid,{})
+    return [days.get((day_start_local+timedelta(days=k)).strftime("%Y-%m-%d"),0.0) for k in range(n_days)]
+
+def sum_seconds_by_days(part: "Partition", uid: int, day_start_local: datetime, n_days: int = 1) -> List[float]:
+    """로컬 자정부터 n일 동안의 일별 합계. 종료된 세션은 롤업(또는 SQL, 캐시)에서, 진행중은 timers에서."""
+    end=day_start_local+timedelta(days=n_days)
+    key=("days",part.key,uid,day_start_local.timestamp(),n_days,data_version(part,end.timestamp(),uid))
+    out=list(result_cache.get(key, lambda: _closed_seconds_by_days(part,uid,day_start_local,n_days)))
+    if (part.key, uid) in timers:
+        for k in range(n_days):
+            d=day_start_local+timedelta(days=k)
+            out[k]+=live_seconds_in_range(part, uid, d, d+timedelta(days=1))
+    return out
+
+def sum_seconds_in_single_day(part:"Partition", uid:int, day_start_local:datetime)->float:
+    return sum_seconds_by_days(part, uid, day_start_local)[0]
+
+def _bucket_overlap(row_uids:List[int], S:List[float], E:List[float], B:List[float]) -> Dict[int, List[float]]:
+    """세션 (S[i], E[i]) 각각이 칸 B[k]~B[k+1]과 겹치는 초를 uid별로 합산. 모두 epoch 초."""
+    n=len(B)-1
+    if not row_uids: return {}
+    if np is not None:
+        s=np.asarray(S,dtype=np.float64)[:,None]; e=np.asarray(E,dtype=np.float64)[:,None]
+        b=np.asarray(B,dtype=np.float64)
+        mat=np.clip(np.minimum(e,b[None,1:])-np.maximum(s,b[None,:-1]),0.0,None)  # (세션 수, n)
+        keys,inv=np.unique(np.asarray(row_uids,dtype=np.int64),return_inverse=True)
+        inv=inv.reshape(-1)
+        sums=np.stack([np.bincount(inv,weights=mat[:,k],minlength=len(keys)) for k in range(n)],axis=1)
+        return {int(u):row.tolist() for u,row in zip(keys,sums)}
+    out: Dict[int, List[float]]={}
+    for u,a,z in zip(row_uids,S,E):
+        row=out.setdefault(u,[0.0]*n)
+        for k in range(n):
+            v=min(z,B[k+1])-max(a,B[k])
+            if v>0: row[k]+=v
+    return out
+
+def _closed_roster(part: "Partition", bounds: List[datetime]) -> Dict[int, List[float]]:
+    """종료된 세션만의 전원 × 칸 합계."""
+    if part.sql:
+        return part.sql.bucket_sums(bounds)
+    B=[x.timestamp() for x in bounds]
+    row_uids: List[int]=[]; S: List[float]=[]; E: List[float]=[]
+    lo,hi=B[0],B[-1]
+    for uid,idx in part.records.items():
+        i=bisect_right(idx.ends,lo); j=bisect_left(idx.starts,hi)   # 범위와 겹치는 세션만
+        if i<j:
+            row_uids.extend([uid]*(j-i)); S.extend(idx.starts[i:j]); E.extend(idx.ends[i:j])
+    return _bucket_overlap(row_uids,S,E,B)
+
+def roster_matrix(part: "Partition", bounds: List[datetime]) -> Dict[int, List[float]]:
+    """파티션 전원 × 칸(bounds 사이) 합계 행렬. 종료 세션 부분은 캐시, 진행중 겹침만 매번 더함."""
+    B=[x.timestamp() for x in bounds]
+    key=("roster",part.key,tuple(B),data_version(part,B[-1]))
+    out={uid:list(row) for uid,row in result_cache.get(key, lambda: _closed_roster(part,bounds)).items()}
+    row_uids: List[int]=[]; S: List[float]=[]; E: List[float]=[]
+    now=time.time()
+    for (k,uid),st in timers.items():
+        t=st["start"].timestamp()
+        end=st["paused_at"].timestamp() if st.get("paused_at") else now
+        if k!=part.key or t>=B[-1] or end<=B[0]: continue   # 범위와 겹치지 않는 타이머
+        row_uids.append(uid); S.append(t); E.append(end)
+    for uid,row in _bucket_overlap(row_uids,S,E,B).items():
+        if uid in out:
+            out[uid]=[a+b for a,b in zip(out[uid],row)]
+        else:
+            out[uid]=row
+    return out
+
+def roster_daily_totals(part: "Partition", day_start_local: datetime, n_days: int = 7) -> Dict[int, List[float]]:
+    """파티션에서 기록이 있거나 진행중인 전원의 일별 합계 { uid: [n일치 초] }."""
+    return roster_matrix(part, day_bounds(day_start_local, n_days))
+
+# ---------------- 세션 인덱스 ----------------
+class SessionIndex:
+    """유저 1명의 세션 목록. 시작/종료 epoch 초를 array('d')로 시작 순 정렬해 두고
+    누적 시간(prefix sum)을 유지해 구간 합계를 이분탐색 두 번 + 양 끝 보정으로 구함.
+    한 유저의 세션은 서로 겹치지 않음."""
+    __slots__=("starts","ends","prefix")
+
+    def __init__(self, sessions=()):
+        pairs=sorted(sessions, key=lambda x:x[0])
+        self.starts=array("d",(s for s,_ in pairs))
+        self.ends=array("d",(e for _,e in pairs))
+        self.prefix=array("d",[0.0])
+        self._rebuild_prefix(0)
+
+    @classmethod
+    def from_flat(cls, flat)->"SessionIndex":
+        """[s0,e0,s1,e1,...] (스냅샷 저장 형식, 이미 정렬됨)에서 바로 만듦."""
+        idx=cls()
+        a=array("d",flat)
+        idx.starts=a[0::2]; idx.ends=a[1::2]
+        idx._rebuild_prefix(0)
+        return idx
+
+    def __len__(self): return len(self.starts)
+    def __iter__(self): return iter(zip(self.starts,self.ends))
+
+    def _rebuild_prefix(self, i:int):
+        del self.prefix[i+1:]
+        acc=self.prefix[i]
+        starts,ends=self.starts,self.ends
+        for k in range(i,len(starts)):
+            acc+=ends[k]-starts[k]
+            self.prefix.append(acc)
+
+    def add(self, start:float, end:float):
+        if not self.starts or start>=self.starts[-1]:
+            # 보통은 가장 최근 세션이므로 끝에 붙이기만 하면 됨
+            self.starts.append(start); self.ends.append(end)
+            self.prefix.append(self.prefix[-1]+(end-start))
+            return
+        i=bisect_right(self.starts,start)
+        self.starts.insert(i,start); self.ends.insert(i,end)
+        self._rebuild_prefix(i)
+
+    def has_start(self, start:float)->bool:
+        i=bisect_left(self.starts,start)
+        return i<len(self.starts) and self.starts[i]==start
+
+    def sum_range(self, rs:float, re:float)->float:
+        i=bisect_right(self.ends,rs)    # 끝이 rs 이후인 첫 세션
+        j=bisect_left(self.starts,re)   # 시작이 re 이후인 첫 세션
+        if i>=j: return 0.0
+        total=self.prefix[j]-self.prefix[i]
+        if self.starts[i]<rs: total-=rs-self.starts[i]
+        if self.ends[j-1]>re: total-=self.ends[j-1]-re
+        return max(0.0,total)
+
+    def prune_before(self, cutoff:float, removed_out:Optional[List]=None)->Tuple[int,int]:
+        """cutoff 이전에 끝난 세션은 버리고 걸친 세션은 cutoff부터로 자름. (삭제 수, 자른 수)
+        정렬돼 있으므로 이분탐색 한 번으로 자를 위치를 찾음. removed_out이 있으면 잘려 나간 구간을 담음."""
+        removed=bisect_right(self.ends,cutoff)
+        trimmed=0
+        if removed_out is not None:
+            removed_out.extend(zip(self.starts[:removed],self.ends[:removed]))
+        if removed:
+            del self.starts[:removed]; del self.ends[:removed]
+        if self.starts and self.starts[0]<cutoff:
+            if removed_out is not None: removed_out.append((self.starts[0],cutoff))
+            self.starts[0]=cutoff; trimmed=1
+        if removed or trimmed:
+            self.prefix=array("d",[0.0]); self._rebuild_prefix(0)
+        return removed,trimmed
+
+# ---------------- 일별 롤업 ----------------
+def local_midnight(t:float)->float:
+    lt=time.localtime(t)
+    return t-(lt.tm_hour*3600+lt.tm_min*60+lt.tm_sec)-(t%1)
+
+def split_by_local_day(start:float, end:float):
+    """세션(epoch 초)을 로컬 자정 기준으로 잘라 (날짜키, 초)를 돌려줌."""
+    cur=start
+    while cur<end:
+        day0=local_midnight(cur)
+        nxt=local_midnight(day0+86400+7200)   # 23/25시간짜리 날(서머타임)도 다음 자정으로
+        seg_end=min(nxt,end)
+        yield time.strftime("%Y-%m-%d",time.localtime(cur)), seg_end-cur
+        cur=seg_end
+
+def rollup_add(part:"Partition", uid:int, start:float, end:float):
+    days=part.rollup.setdefault(uid,{})
+    for key,secs in split_by_local_day(start,end):
+        days[key]=days.get(key,0.0)+secs
+
+def rebuild_rollup(part:"Partition"):
+    part.rollup.clear()
+    for uid,idx in part.records.items():
+        for s,e in idx: rollup_add(part,uid,s,e)
+
+def prune_rollup(part:"Partition", cutoff_local:datetime):
+    # cutoff은 로컬 자정이므로 그 이전 날짜 칸만 통째로 버리면 됨
+    key=cutoff_local.strftime("%Y-%m-%d")
+    for uid,days in list(part.rollup.items()):
+        for d in [d for d in days if d<key]: del days[d]
+        if not days: del part.rollup[uid]
+
+def record_session(part:"Partition", uid:int, start:float, end:float):
+    """종료된 세션(epoch 초) 반영: 인덱스 + 롤업 + 저널 (sqlite면 DB에 추가)."""
+    part.version+=1  # 진행중 기간의 캐시된 합계를 버리게 함
+    part.board.add_session(uid, start, end)
+    if part.sql:
+        part.sql.add_session(uid, start, end); return
+    part.records.setdefault(uid, SessionIndex()).add(start, end)
+    rollup_add(part, uid, start, end)
+    append_session(part, uid, start, end)
+
+# ---------------- 랭킹 ----------------
+class RankedTotals:
+    """uid별 합계 + (−합계, uid) 정렬 목록. 갱신은 이분탐색으로 제자리 교체, 상위 N명은 앞에서 잘라 읽기만 함."""
+    __slots__=("totals","order")
+
+    def __init__(self, totals: Optional[Dict[int,float]]=None):
+        self.totals: Dict[int,float]=dict(totals or {})
+        self.order: List[Tuple[float,int]]=sorted((-v,u) for u,v in self.totals.items())
+
+    def __len__(self): return len(self.totals)
+
+    def add(self, uid:int, secs:float):
+        old=self.totals.get(uid)
+        if old is not None:
+            del self.order[bisect_left(self.order,(-old,uid))]
+        new=(old or 0.0)+secs
+        if new<1e-3:   # 정리로 다 빠진 유저(부동소수 오차 포함)
+            self.totals.pop(uid,None); return
+        self.totals[uid]=new
+        insort(self.order,(-new,uid))
+
+    def apply(self, deltas:Dict[int,float]):
+        """여러 유저를 한꺼번에 갱신. 많으면 합계만 고치고 한 번에 다시 정렬."""
+        if len(deltas)*8<len(self.order):
+            for uid,secs in deltas.items(): self.add(uid,secs)
+            return
+        for uid,secs in deltas.items():
+            new=self.totals.get(uid,0.0)+secs
+            if new<1e-3: self.totals.pop(uid,None)
+            else: self.totals[uid]=new
+        self.order=sorted((-v,u) for u,v in self.totals.items())
+
+    def top(self, n:int)->List[Tuple[int,float]]:
+        return [(uid,-neg) for neg,uid in self.order[:n]]
+
+class Leaderboard:
+    """파티션의 기간별(일/주/월/전체) 합계 순위표. 세션이 닫힐 때 더하고 정리로 빠질 때 뺌.
+    칸 키: ("day","YYYY-MM-DD") / ("week", 월요일 날짜) / ("month","YYYY-MM") / ("all","")."""
+    def __init__(self):
+        self.buckets: Dict[Tuple[str,str],RankedTotals]={}
+        self._keys: Dict[str,Tuple[Tuple[str,str],...]]={}
+
+    def keys_for_day(self, day:str)->Tuple[Tuple[str,str],...]:
+        ks=self._keys.get(day)
+        if ks is None:
+            d=datetime.strptime(day,"%Y-%m-%d")
+            mon=(d-timedelta(days=d.weekday())).strftime("%Y-%m-%d")
+            ks=self._keys[day]=(("day",day),("week",mon),("month",day[:7]),("all",""))
+        return ks
+
+    def add_session(self, uid:int, start:float, end:float):
+        for day,secs in split_by_local_day(start,end):
+            for k in self.keys_for_day(day):
+                b=self.buckets.get(k)
+                if b is None: b=self.buckets[k]=RankedTotals()
+                b.add(uid,secs)
+
+    def _sum_days(self, rows:Iterable[Tuple[int,str,float]], sign:float=1.0)->Dict[Tuple[str,str],Dict[int,float]]:
+        acc: Dict[Tuple[str,str],Dict[int,float]]={}
+        for uid,day,secs in rows:
+            for k in self.keys_for_day(day):
+                t=acc.get(k)
+                if t is None: t=acc[k]={}
+                t[uid]=t.get(uid,0.0)+sign*secs
+        return acc
+
+    def remove_sessions(self, rows:Iterable[Tuple[int,float,float]]):
+        """정리로 빠진 구간을 한꺼번에 뺌 — 칸별로 모아서 칸마다 한 번만 갱신."""
+        acc=self._sum_days(((uid,day,secs) for uid,a,z in rows for day,secs in split_by_local_day(a,z)), -1.0)
+        for k,deltas in acc.items():
+            b=self.buckets.get(k)
+            if b is None: continue
+            b.apply(deltas)
+            if not b.totals: del self.buckets[k]
+
+    @classmethod
+    def from_days(cls, rows:Iterable[Tuple[int,str,float]])->"Leaderboard":
+        """(uid, 날짜, 초)에서 한 번에 만듦 — 칸마다 합계를 모은 뒤 한 번만 정렬."""
+        lb=cls()
+        lb.buckets={k:RankedTotals(t) for k,t in lb._sum_days(rows).items()}
+        return lb
+
+def rebuild_leaderboard(part:"Partition"):
+    if part.sql:
+        rows=((u,day,secs) for u,a,z in part.sql.conn.execute("SELECT uid,start,end FROM sessions")
+              for day,secs in split_by_local_day(a,z))
+    else:
+        rows=((u,day,secs) for u,days in part.rollup.items() for day,secs in days.items())
+    part.board=Leaderboard.from_days(rows)
+
+def leaderboard_period(kind:str)->Tuple[Tuple[str,str],Optional[datetime],Optional[datetime]]:
+    """기간 종류(day/week/month/all) → (순위표 칸 키, 로컬 시작, 끝)."""
+    if kind=="day":
+        s,e=today_bounds_local(); return ("day",s.strftime("%Y-%m-%d")),s,e
+    if kind=="week":
+        s,e=week_bounds_local_monday_to_sunday(); return ("week",s.strftime("%Y-%m-%d")),s,e
+    if kind=="month":
+        s=datetime.now().astimezone().replace(day=1,hour=0,minute=0,second=0,microsecond=0)
+        e=(s+timedelta(days=32)).replace(day=1)
+        return ("month",s.strftime("%Y-%m")),s,e
+    return ("all",""),None,None
+
+def leaderboard_page(part:"Partition", kind:str, offset:int=0, limit:int=10)->Tuple[List[Tuple[int,int,float]],int]:
+    """순위 offset+1 ~ offset+limit 의 (순위, uid, 초)와 전체 인원.
+    진행중 타이머 L명만 순위를 바꿀 수 있으므로 종료 합계 상위 offset+limit+L명 + 진행중만 보면 충분 → 전원을 훑지 않음."""
+    key,rs,re=leaderboard_period(kind)
+    b=part.board.buckets.get(key) or RankedTotals()
+    now=datetime.now(timezone.utc)
+    live: Dict[int,float]={}
+    for (k,uid),st in timers.items():
+        if k!=part.key: continue
+        end=live_end(st,now)
+        secs=(end-st["start"]).total_seconds() if rs is None else overlap_seconds(st["start"],end,rs,re)
+        if secs>0: live[uid]=secs
+    cand=dict(b.top(offset+limit+len(live)))
+    for uid,secs in live.items():
+        cand[uid]=b.totals.get(uid,0.0)+secs
+    ranked=sorted(cand.items(), key=lambda x:(-x[1],x[0]))[offset:offset+limit]
+    total=len(b)+sum(1 for uid in live if uid not in b.totals)
+    return [(offset+n+1,uid,secs) for n,(uid,secs) in enumerate(ranked)],total
+
+# ---------------- 백그라운드 저장 ----------------
+class PersistWriter(threading.Thread):
+    """디스크 쓰기 전담 스레드. 코루틴은 작업을 넘기기만 하고 바로 돌아감.
+    같은 키의 스냅샷 작업은 마지막 것만 남기고, 저널 줄은 파일별로 한 번에 씀.
+    작업은 넘어온 순서대로 처리하므로 스냅샷 이후에 추가된 저널 줄은 잘리지 않음."""
+    def __init__(self, coalesce:float):
+        super().__init__(name="persist-writer", daemon=True)
+        self.coalesce=coalesce
+        self._cv=threading.Condition()
+        self._ops: List[Tuple[str,str,object]]=[]   # ("line", path, text) | ("job", key, fn)
+        self._busy=False
+        self._closed=False
+        self.writes=0
+
+    def submit(self, key:str, fn:Callable[[],None]):
+        with self._cv:
+            self._ops.append(("job",key,fn)); self._cv.notify()
+
+    def append(self, path:str, line:str):
+        with self._cv:
+            self._ops.append(("line",path,line)); self._cv.notify()
+
+    def run(self):
+        while True:
+            with self._cv:
+                while not self._ops and not self._closed:
+                    self._cv.wait()
+                if not self._ops and self._closed:
+                    return
+                self._busy=True
+            if not self._closed:
+                time.sleep(self.coalesce)  # 몰려드는 요청을 모아서 한 번에
+            with self._cv:
+                ops,self._ops=self._ops,[]
+            try:
+                self._drain(ops)
+            finally:
+                with self._cv:
+                    self._busy=False; self._cv.notify_all()
+
+    def _drain(self, ops):
+        last={key:i for i,(kind,key,_) in enumerate(ops) if kind=="job"}
+        pending: Dict[str,List[str]]={}
+        def write_lines():
+            for path,lines in pending.items():
+                try:
+                    with metrics.timer("studybot_persist_seconds", job="journal"):
+                        with open(path,"a",encoding="utf-8") as f:
+                            f.write("".join(l+"\n" for l in lines)); f.flush(); os.fsync(f.fileno())
+                    self.writes+=1
+                except Exception as e:
+                    metrics.inc("studybot_persist_failures_total", job="journal")
+                    print(f"⚠️ 저널 쓰기 실패 {path}: {e}")
+            pending.clear()
+        for i,(kind,key,val) in enumerate(ops):
+            if kind=="line":
+                pending.setdefault(key,[]).append(val)
+            elif last[key]==i:
+                write_lines()
+                job=key.split(":",1)[0]   # records:<파티션> → records
+                try:
+                    with metrics.timer("studybot_persist_seconds", job=job):
+                        val()
+                    self.writes+=1
+                except Exception as e:
+                    metrics.inc("studybot_persist_failures_total", job=job)
+                    print(f"⚠️ 저장 실패({key}): {e}")
+        write_lines()
+
+    def backlog(self)->int:
+        with self._cv: return len(self._ops)
+
+    def flush(self, timeout:Optional[float]=None)->bool:
+        """대기 중인 쓰기가 모두 끝날 때까지 기다림(다른 스레드/종료 시)."""
+        with self._cv:
+            return self._cv.wait_for(lambda: not self._ops and not self._busy, timeout)
+
+    def close(self):
+        with self._cv:
+            self._closed=True; self._cv.notify_all()
+        if self.is_alive(): self.join()
+
+persist = PersistWriter(PERSIST_COALESCE_SECONDS)
+persist.start()
 
 # ---------------- 저장/로드 ----------------
 def dt_to_iso(dt:datetime)->str: return dt.astimezone(timezone.utc).isoformat()
 def dt_from_iso(s:str)->datetime: return datetime.fromisoformat(s).astimezone(timezone.utc)
-
-def save_records():
+def epoch_from_json(v)->float:
+    # 새 형식은 epoch 숫자, 예전 파일은 ISO 문자열
+    return float(v) if isinstance(v,(int,float)) else dt_from_iso(v).timestamp()
+
+def _atomic_write_json(path:str, obj):
+    # 임시 파일에 쓴 뒤 교체 → 쓰는 도중 죽어도 기존 파일은 온전함 (임시 파일은 프로세스별로 따로)
+    tmp=f"{path}.{os.getpid()}.tmp"
+    with open(tmp,"w",encoding="utf-8") as f:
+        json.dump(obj,f,ensure_ascii=False,indent=2)
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp,path)
+
+def append_session(part:"Partition", uid:int, start:float, end:float):
+    """종료된 세션 1개를 저널 끝에 한 줄로 추가 (기록량과 무관하게 일정한 비용)."""
+    line=json.dumps({"uid":uid,"s":round(start,3),"e":round(end,3)})
+    persist.append(part.records_log, line)
+
+def _write_records_snapshot(part:"Partition", gen:int, copied:List[Tuple[int,array,array]], days_copy:Dict[int,Dict[str,float]]):
+    # 유저 1명 = 1줄, 세션은 [s0,e0,s1,e1,...] epoch 초. 전체가 그대로 유효한 JSON이면서
+    # 줄 단위로도 읽을 수 있어 내보내기에서 파일 전체를 올리지 않고 훑을 수 있음
+    tmp=f"{part.records_json}.{os.getpid()}.tmp"
+    with open(tmp,"w",encoding="utf-8") as f:
+        f.write('{"gen":%d,"format":"epoch","records":{' % gen)
+        for n,(uid,starts,ends) in enumerate(copied):
+            flat=[round(x,3) for pair in zip(starts,ends) for x in pair]
+            f.write(("," if n else "")+"\n"+json.dumps(str(uid))+":"+json.dumps(flat,separators=(",",":")))
+        f.write("\n}}\n")
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp,part.records_json)
+    _atomic_write_json(part.rollup_json,{"gen":gen,"rollup":{str(uid):days for uid,days in days_copy.items()}})
+    # 스냅샷 교체 후 저널 비우기. 그 사이에 죽어도 재생 시 중복은 걸러짐
+    open(part.records_log,"w",encoding="utf-8").close()
+
+def save_records(part:"Partition"):
+    """파티션 전체 스냅샷을 records.json에 쓰고 저널을 비움(= 컴팩션). 실제 쓰기는 저장 스레드에서."""
+    if part.sql: return  # sqlite는 세션마다 바로 DB에 반영됨
+    part.gen+=1
+    # 루프 위에서는 리스트 복사만 하고 직렬화/디스크 쓰기는 저장 스레드가 처리
+    copied=[(uid,idx.starts[:],idx.ends[:]) for uid,idx in part.records.items()]
+    days_copy={uid:dict(days) for uid,days in part.rollup.items()}
+    gen=part.gen
+    persist.submit(f"records:{part.key}", lambda: _write_records_snapshot(part,gen,copied,days_copy))
+
+def _replay_records_log(part:"Partition"):
+    # 저널 재생: 스냅샷에 이미 있는 세션은 건너뜀, 잘린 마지막 줄은 무시
+    tail_ok=True
     try:
-        out={str(uid):[(dt_to_iso(s),dt_to_iso(e)) for s,e in lst] for uid,lst in records.items()}
-        with open(RECORDS_JSON,"w",encoding="utf-8") as f: json.dump(out,f,ensure_ascii=False,indent=2)
-    except: pass
+        with open(part.records_log,"r",encoding="utf-8") as f:
+            for line in f:
+                tail_ok=line.endswith("\n")
+                try:
+                    row=json.loads(line)
+                    uid=int(row["uid"]); s=epoch_from_json(row["s"]); e=epoch_from_json(row["e"])
+                except Exception:
+                    continue
+                idx=part.records.setdefault(uid,SessionIndex())
+                if idx.has_start(s):
+                    continue
+                idx.add(s,e)
+                rollup_add(part,uid,s,e)
+        if not tail_ok:
+            # 쓰다 만 마지막 줄 뒤에 이어 쓰지 않도록 줄바꿈으로 마감
+            with open(part.records_log,"a",encoding="utf-8") as f: f.write("\n")
+    except FileNotFoundError: pass
 
-def load_records():
+def _load_rollup(part:"Partition")->bool:
+    # 스냅샷과 세대가 같을 때만 신뢰, 아니면 기록에서 다시 만듦
     try:
-        with open(RECORDS_JSON,"r",encoding="utf-8") as f: raw=json.load(f)
+        with open(part.rollup_json,"r",encoding="utf-8") as f: raw=json.load(f)
+        if raw.get("gen")!=part.gen: return False
+        part.rollup.clear()
+        for k,days in raw["rollup"].items():
+            part.rollup[int(k)]={d:float(v) for d,v in days.items()}
+        return True
+    except FileNotFoundError: return False
+    except: return False
+
+def load_records(part:"Partition"):
+    if part.sql:
+        part.sql.migrate_from_json(part); return
+    try:
+        with open(part.records_json,"r",encoding="utf-8") as f: raw=json.load(f)
+        fmt=None
+        if "records" in raw:
+            part.gen=int(raw.get("gen",0)); fmt=raw.get("format"); raw=raw["records"]
         for k,lst in raw.items():
-            records[int(k)]=[(dt_from_iso(s),dt_from_iso(e)) for s,e in lst]
+            if fmt=="epoch":
+                part.records[int(k)]=SessionIndex.from_flat(lst)
+            else:
+                # 예전 ISO 문자열 [(시작, 종료), ...] 형식
+                part.records[int(k)]=SessionIndex((epoch_from_json(s),epoch_from_json(e)) for s,e in lst)
     except FileNotFoundError: pass
     except: pass
-
-def save_running():
+    if not _load_rollup(part):
+        rebuild_rollup(part)
+    _replay_records_log(part)
+
+def records_log_size(part:"Partition")->int:
+    if part.sql: return 0
+    try: return os.path.getsize(part.records_log)
+    except OSError: return 0
+
+def save_running(part:"Partition"):
+    # seen_at: 봇이 살아서 이 타이머를 진행중으로 저장한 마지막 시각 → 꺼져 있던 사이 나간 유저는 이 시각으로 닫음
+    # 복구만 하고 아직 음성 상태와 맞추지 않은(restored) 타이머는 건드리지 않음 — 재시작 시각으로 덮이면 안 됨
+    now=datetime.now(timezone.utc)
+    out={}
+    for (key,uid),st in timers.items():
+        if key!=part.key: continue
+        if not st.get("paused_at") and not st.get("restored"): st["seen_at"]=now
+        out[str(uid)]={"start":dt_to_iso(st["start"]), "mention":st.get("mention"), "avatar":st.get("avatar"),
+                       "guild_id":st.get("guild_id"), "channel_id":st.get("channel_id"), "message_id":st.get("message_id"),
+                       "paused_at":dt_to_iso(st["paused_at"]) if st.get("paused_at") else None,
+                       "seen_at":dt_to_iso(st["seen_at"]) if st.get("seen_at") else None}
+    if part.sql:
+        store=part.sql
+        persist.submit(f"running:{part.key}", lambda: store.replace_running(out)); return
+    persist.submit(f"running:{part.key}", lambda: _atomic_write_json(part.running_json,out))
+
+def load_running_partial(part:"Partition"):
     try:
-        out={str(uid):{"start":dt_to_iso(st["start"]), "mention":st.get("mention"), "avatar":st.get("avatar")} for uid,st in timers.items()}
-        with open(RUNNING_JSON,"w",encoding="utf-8") as f: json.dump(out,f,ensure_ascii=False,indent=2)
+        if part.sql:
+            raw=part.sql.load_running()
+        else:
+            with open(part.running_json,"r",encoding="utf-8") as f: raw=json.load(f)
+        for k,st in raw.items():
+            # 메시지 객체는 재접속 후 reconcile_timers가 ID로 다시 붙임
+            timers[(part.key,int(k))]={"start":dt_from_iso(st["start"]), "message":None, "mention":st.get("mention"), "avatar":st.get("avatar"),
+                                       "guild_id":st.get("guild_id"), "channel_id":st.get("channel_id"), "message_id":st.get("message_id"),
+                                       "paused_at":dt_from_iso(st["paused_at"]) if st.get("paused_at") else None,
+                                       "seen_at":dt_from_iso(st["seen_at"]) if st.get("seen_at") else None,
+                                       "restored":True}  # reconcile_timers가 실제 음성 상태와 맞출 때까지
+    except FileNotFoundError: pass
     except: pass
 
-def load_running_partial():
+# ---------------- 보관(아카이브) ----------------
+def _archive_week_key(start:float)->str:
+    y,w,_=datetime.fromtimestamp(start).isocalendar()
+    return f"{y}-W{w:02d}"
+
+def write_archive(archive_dir:str, rows:List[Tuple[int,float,float]]):
+    """정리된 세션을 시작 주(로컬 ISO 주)별 gzip 조각에 덧붙임. 저장 스레드에서 실행."""
+    if not rows: return
+    os.makedirs(archive_dir, exist_ok=True)
+    by_week: Dict[str,List[str]]={}
+    keys: Dict[float,str]={}   # 같은 날 세션은 주 키 계산을 한 번만
+    for uid,s,e in rows:
+        day0=local_midnight(s)
+        key=keys.get(day0) or keys.setdefault(day0,_archive_week_key(s))
+        by_week.setdefault(key,[]).append('{"uid":%d,"s":%r,"e":%r}' % (uid,round(s,3),round(e,3)))
+    for key,lines in by_week.items():
+        # gzip은 멤버를 이어 붙여도 하나의 스트림으로 읽힘 → 기존 조각을 다시 쓰지 않고 추가만
+        with gzip.open(os.path.join(archive_dir,f"{key}.jsonl.gz"),"at",encoding="utf-8") as f:
+            f.write("".join(l+"\n" for l in lines))
+
+def archive_segments(archive_dir:str, rs:Optional[datetime]=None, re:Optional[datetime]=None)->List[Tuple[datetime,str]]:
+    """범위와 겹칠 수 있는 보관 조각 (주 시작, 경로) 목록. 파일은 열지 않음."""
+    try: names=sorted(os.listdir(archive_dir))
+    except FileNotFoundError: return []
+    out=[]
+    for name in names:
+        if not name.endswith(".jsonl.gz"): continue
+        try:
+            y,w=name[:-len(".jsonl.gz")].split("-W")
+            wk=datetime.fromisocalendar(int(y),int(w),1).astimezone()
+        except ValueError:
+            continue
+        # 조각은 시작 주 기준이라 다음 주로 넘어가는 세션이 있을 수 있어 여유 1주
+        if re is not None and wk>=re: continue
+        if rs is not None and wk+timedelta(days=14)<=rs: continue
+        out.append((wk,os.path.join(archive_dir,name)))
+    return out
+
+def iter_archived_sessions(archive_dir:str, rs:Optional[datetime]=None, re:Optional[datetime]=None, uid:Optional[int]=None):
+    """보관된 세션을 (uid, start, end) epoch 초로 하나씩 돌려줌. 필요한 조각만 그때그때 열어 메모리에 올리지 않음."""
+    lo=rs.timestamp() if rs is not None else None
+    hi=re.timestamp() if re is not None else None
+    for _,path in archive_segments(archive_dir,rs,re):
+        try:
+            with gzip.open(path,"rt",encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row=json.loads(line)
+                        u=int(row["uid"]); s=epoch_from_json(row["s"]); e=epoch_from_json(row["e"])
+                    except Exception:
+                        continue
+                    if uid is not None and u!=uid: continue
+                    if lo is not None and e<=lo: continue
+                    if hi is not None and s>=hi: continue
+                    yield u,s,e
+        except (OSError, EOFError) as e:
+            print(f"⚠️ 보관 조각 읽기 실패 {path}: {e}")
+
+# ---------------- SQLite 저장소 ----------------
+class SqliteStore:
+    """STORAGE_BACKEND=sqlite 일 때 파티션 하나의 저장소. 세션은 (uid, start, end) 인덱스가 걸린 테이블에
+    epoch 초로 보관하고, 구간 합계/일람/정리는 SQL 집계로 처리해 메모리에 기록을 올리지 않음.
+    쓰기는 저장 스레드 전용 연결로, 읽기는 이벤트 루프 쪽 연결로 함(WAL)."""
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions(uid INTEGER NOT NULL, start REAL NOT NULL, end REAL NOT NULL, PRIMARY KEY(uid, start));
+    CREATE INDEX IF NOT EXISTS sessions_uid_start_end ON sessions(uid, start, end);
+    CREATE INDEX IF NOT EXISTS sessions_end ON sessions(end);
+    CREATE TABLE IF NOT EXISTS running(uid INTEGER PRIMARY KEY, start TEXT NOT NULL, mention TEXT, avatar TEXT,
+                                       guild_id INTEGER, channel_id INTEGER, message_id INTEGER, paused_at TEXT, seen_at TEXT);
+    CREATE TABLE IF NOT EXISTS autotrack(uid INTEGER PRIMARY KEY, enabled INTEGER NOT NULL);
+    CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, path:str, archive_dir:str):
+        self.path=path
+        self.archive_dir=archive_dir
+        self.conn=self._connect()        # 이벤트 루프(읽기/마이그레이션)
+        self.conn.executescript(self.SCHEMA)
+        for col,typ in (("guild_id","INTEGER"),("channel_id","INTEGER"),("message_id","INTEGER"),("paused_at","TEXT"),("seen_at","TEXT")):
+            # 이전 스키마로 만든 DB에 열 추가
+            try: self.conn.execute(f"ALTER TABLE running ADD COLUMN {col} {typ}")
+            except sqlite3.OperationalError: pass
+        self._wconn: Optional[sqlite3.Connection]=None  # 저장 스레드(쓰기)
+        # 아직 커밋되지 않은 세션: 조회 시 함께 더해서 종료 직후 조회에도 빠지지 않게 함
+        self._lock=threading.Lock()
+        self._pending: Dict[int, Tuple[int,float,float]]={}
+        self._seq=0
+        self.pruned=0  # 저장 스레드에서 끝난 정리 횟수 (집계 캐시 키)
+
+    def _connect(self)->sqlite3.Connection:
+        conn=sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _writer(self)->sqlite3.Connection:
+        if self._wconn is None: self._wconn=self._connect()
+        return self._wconn
+
+    # --- 세션 ---
+    def add_session(self, uid:int, start:float, end:float):
+        with self._lock:
+            self._seq+=1
+            self._pending[self._seq]=(uid,start,end)
+        persist.submit(f"sql-sessions:{self.path}", self._flush_sessions)
+
+    def _flush_sessions(self):
+        with self._lock:
+            rows=list(self._pending.items())
+        if not rows: return
+        conn=self._writer()
+        conn.executemany("INSERT OR IGNORE INTO sessions(uid,start,end) VALUES(?,?,?)", [r for _,r in rows])
+        with self._lock:
+            conn.commit()
+            for seq,_ in rows: self._pending.pop(seq,None)
+
+    def sum_range(self, uid:int, rs:datetime, re:datetime)->float:
+        return self.bucket_sums([rs,re],uid).get(uid,[0.0])[0]
+
+    def bucket_sums(self, bounds:List[datetime], uid:Optional[int]=None)->Dict[int,List[float]]:
+        """bounds[k]~bounds[k+1] 칸마다 세션 겹침 합계를 uid별로 한 번의 GROUP BY로 계산."""
+        b=[x.timestamp() for x in bounds]
+        cols=",".join("SUM(MAX(0, MIN(end,?)-MAX(start,?)))" for _ in range(len(b)-1))
+        args: List[float]=[]
+        for k in range(len(b)-1): args+=[b[k+1],b[k]]
+        sql=f"SELECT uid,{cols} FROM sessions WHERE start<? AND end>?"
+        args+=[b[-1],b[0]]
+        if uid is not None:
+            sql+=" AND uid=?"; args.append(uid)
+        sql+=" GROUP BY uid"
+        with self._lock:
+            out={row[0]:[float(v or 0.0) for v in row[1:]] for row in self.conn.execute(sql,args)}
+            pending=list(self._pending.values())
+        for pu,ps,pe in pending:
+            if uid is not None and pu!=uid: continue
+            row=out.setdefault(pu,[0.0]*(len(b)-1))
+            for k in range(len(b)-1):
+                row[k]+=max(0.0,min(pe,b[k+1])-max(ps,b[k]))
+        return {u:row for u,row in out.items() if any(row)}
+
+    def prune_before(self, cutoff:datetime, removed_out:Optional[List]=None)->Tuple[int,int]:
+        """removed_out이 있으면 잘려 나갈 구간 (uid, start, end)를 담음."""
+        c=cutoff.timestamp()
+        removed=self.conn.execute("SELECT COUNT(*) FROM sessions WHERE end<=?",(c,)).fetchone()[0]
+        trimmed=self.conn.execute("SELECT COUNT(*) FROM sessions WHERE start<? AND end>?",(c,c)).fetchone()[0]
+        if removed_out is not None:
+            removed_out.extend(self.conn.execute("SELECT uid,start,MIN(end,?) FROM sessions WHERE start<?",(c,c)))
+        def job():
+            conn=self._writer()
+            # 지우기 전에 잘려 나갈 구간을 압축 보관
+            rows=conn.execute("SELECT uid,start,MIN(end,?) FROM sessions WHERE start<?",(c,c)).fetchall()
+            write_archive(self.archive_dir, rows)
+            conn.execute("DELETE FROM sessions WHERE end<=?",(c,))
+            conn.execute("UPDATE sessions SET start=? WHERE start<? AND end>?",(c,c,c))
+            with self._lock:
+                conn.commit(); self.pruned+=1
+        persist.submit(f"sql-prune:{self.path}", job)
+        return removed,trimmed
+
+    # --- 진행중/자동기록 ---
+    def replace_running(self, out:Dict[str,Dict]):
+        conn=self._writer()
+        conn.execute("DELETE FROM running")
+        conn.executemany("INSERT INTO running(uid,start,mention,avatar,guild_id,channel_id,message_id,paused_at,seen_at) VALUES(?,?,?,?,?,?,?,?,?)",
+                         [(int(k),st["start"],st.get("mention"),st.get("avatar"),st.get("guild_id"),st.get("channel_id"),st.get("message_id"),st.get("paused_at"),st.get("seen_at"))
+                          for k,st in out.items()])
+        conn.commit()
+
+    def load_running(self)->Dict[str,Dict]:
+        cols=("start","mention","avatar","guild_id","channel_id","message_id","paused_at","seen_at")
+        return {str(row[0]):dict(zip(cols,row[1:]))
+                for row in self.conn.execute("SELECT uid,start,mention,avatar,guild_id,channel_id,message_id,paused_at,seen_at FROM running")}
+
+    def set_autotrack(self, uid:int, val:bool):
+        # 유저 한 줄만 바꿈 → 여러 프로세스가 같은 DB를 써도 서로의 값을 지우지 않음
+        conn=self._writer()
+        conn.execute("INSERT OR REPLACE INTO autotrack(uid,enabled) VALUES(?,?)",(uid,int(val)))
+        conn.commit()
+
+    def load_autotrack(self)->Dict[str,bool]:
+        self.migrate_autotrack_json()
+        return {str(uid):bool(v) for uid,v in self.conn.execute("SELECT uid,enabled FROM autotrack")}
+
+    # --- JSON → SQLite 1회 이전 ---
+    def _migrated(self, *keys:str)->bool:
+        # migrated_json: 기록/진행중/자동기록을 한꺼번에 옮기던 예전 표시
+        q="SELECT 1 FROM meta WHERE key IN (%s)" % ",".join("?"*len(keys))
+        return self.conn.execute(q,keys).fetchone() is not None
+
+    def migrate_from_json(self, part:"Partition"):
+        if self._migrated("migrated_records","migrated_json"):
+            return
+        # 기존 JSON 로더를 그대로 재사용하기 위해 잠시 JSON 모드로 읽음
+        part.sql=None
+        try:
+            load_records(part); load_running_partial(part)
+        finally:
+            part.sql=self
+        mine=[(uid,st) for (key,uid),st in timers.items() if key==part.key]
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO sessions(uid,start,end) VALUES(?,?,?)",
+                                  ((uid,s,e) for uid,idx in part.records.items() for s,e in idx))
+            self.conn.executemany("INSERT OR REPLACE INTO running(uid,start,mention,avatar,guild_id,channel_id,message_id,paused_at,seen_at) VALUES(?,?,?,?,?,?,?,?,?)",
+                                  [(uid,dt_to_iso(st["start"]),st.get("mention"),st.get("avatar"),st.get("guild_id"),st.get("channel_id"),st.get("message_id"),
+                                    dt_to_iso(st["paused_at"]) if st.get("paused_at") else None,
+                                    dt_to_iso(st["seen_at"]) if st.get("seen_at") else None)
+                                   for uid,st in mine])
+            self.conn.execute("INSERT INTO meta(key,value) VALUES('migrated_records',?)",(dt_to_iso(datetime.now(timezone.utc)),))
+        n=sum(len(idx) for idx in part.records.values())
+        part.records.clear(); part.rollup.clear()
+        for uid,_ in mine: timers.pop((part.key,uid),None)
+        print(f"📦 JSON → SQLite 이전 완료({part.dir}): 세션 {n}개")
+
+    def migrate_autotrack_json(self):
+        if self._migrated("migrated_autotrack","migrated_json"):
+            return
+        try:
+            with open(AUTOTRACK_JSON,"r",encoding="utf-8") as f: raw=json.load(f)
+        except FileNotFoundError: raw={}
+        except: raw={}
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO autotrack(uid,enabled) VALUES(?,?)",
+                                  [(int(k),int(bool(v))) for k,v in raw.items()])
+            self.conn.execute("INSERT OR IGNORE INTO meta(key,value) VALUES('migrated_autotrack',?)",(dt_to_iso(datetime.now(timezone.utc)),))
+
+_stores: Dict[str, SqliteStore] = {}
+
+def open_store(path:str, archive_dir:str)->SqliteStore:
+    # 같은 DB 파일은 연결/대기열을 하나만 씀 (예: 예전 길드 파티션과 자동기록이 둘 다 DATA_DIR/records.db)
+    store=_stores.get(path)
+    if store is None:
+        store=_stores[path]=SqliteStore(path, archive_dir)
+    return store
+
+def autotrack_store()->SqliteStore:
+    return open_store(os.path.join(DATA_DIR,"records.db"), os.path.join(DATA_DIR,"archive"))
+
+# ---------------- 길드 파티션 ----------------
+class Partition:
+    """길드 하나의 기록 상태와 저장 파일 묶음 (분할하지 않으면 전체가 파티션 하나).
+    한 길드는 그 길드를 맡은 샤드 프로세스 하나만 쓰므로, 샤드 범위가 다른 여러 프로세스가
+    같은 DATA_DIR을 써도 서로의 파일을 건드리지 않음."""
+    def __init__(self, key:int, root:str):
+        self.key=key
+        self.dir=root
+        self.records_json=os.path.join(root,"records.json")
+        self.running_json=os.path.join(root,"running.json")
+        # 세션 저널(한 줄 = 종료된 세션 1개). 일정 크기를 넘으면 records.json 스냅샷으로 접어 넣음
+        self.records_log=os.path.join(root,"records.log")
+        # 일별 합계 롤업 { uid: { "YYYY-MM-DD": 초 } } — 스냅샷과 같은 세대(gen)로 저장
+        self.rollup_json=os.path.join(root,"rollup.json")
+        # 정리된 세션의 주별 압축 보관 폴더 (YYYY-Www.jsonl.gz)
+        self.archive_dir=os.path.join(root,"archive")
+        # 길드별로 마지막에 동기화한 슬래시 명령 해시 (같으면 sync 생략)
+        self.command_sync_json=os.path.join(root,"command_sync.json")
+        # 대시보드 모드에서 로그 채널별 고정 메시지 ID { 채널ID: {"guild_id", "message_id"} }
+        self.dashboard_json=os.path.join(root,"dashboard.json")
+        self.records: Dict[int, SessionIndex]={}
+        self.rollup: Dict[int, Dict[str, float]]={}
+        self.gen=0  # records.json / rollup.json 스냅샷 세대
+        # 집계 캐시 키에 들어가는 데이터 버전: 세션이 추가될 때 / 정리될 때
+        self.version=0
+        self.prune_version=0
+        self.board=Leaderboard()
+        self.sql: Optional[SqliteStore]=None
+
+partitions: Dict[int, Partition] = {}
+
+def partition_key(guild_id: Optional[int]) -> int:
+    # 분할하지 않으면 모든 길드가 파티션 0 (예전처럼 유저 ID만으로 구분)
+    if not PARTITION_BY_GUILD: return 0
+    return guild_id or LEGACY_GUILD_ID
+
+def partition_dir(key: int) -> str:
+    if key==0 or key==LEGACY_GUILD_ID: return DATA_DIR
+    return os.path.join(DATA_DIR,"guilds",str(key))
+
+def owns_guild(guild_id: int) -> bool:
+    """이 프로세스의 샤드가 맡은 길드인지 (디스코드 샤드 배정: (길드ID >> 22) % 샤드 수)."""
+    if not SHARD_COUNT or not SHARD_IDS: return True
+    return (guild_id>>22)%SHARD_COUNT in SHARD_IDS
+
+def load_partition(part: Partition):
+    os.makedirs(part.dir, exist_ok=True)
+    if USE_SQLITE:
+        part.sql=open_store(os.path.join(part.dir,"records.db"), part.archive_dir)
+    load_records(part)
+    load_running_partial(part)
+    load_dashboards(part)
+    rebuild_leaderboard(part)
+
+def get_partition(guild_id: Optional[int]) -> Partition:
+    """길드의 파티션. 처음 보는 길드면 그 자리에서 만들고 파일을 읽음."""
+    key=partition_key(guild_id)
+    part=partitions.get(key)
+    if part is None:
+        part=partitions[key]=Partition(key, partition_dir(key))
+        load_partition(part)
+    return part
+
+def stored_guild_ids() -> List[int]:
+    """DATA_DIR에 파티션 파일이 있는(또는 예전 파일을 이어 쓰는) 길드 목록."""
+    gids=set()
+    if LEGACY_GUILD_ID: gids.add(LEGACY_GUILD_ID)
     try:
-        with open(RUNNING_JSON,"r",encoding="utf-8") as f: raw=json.load(f)
-        for k,st in raw.items():
-            timers[int(k)]={"start":dt_from_iso(st["start"]), "message":None, "mention":st.get("mention"), "avatar":st.get("avatar")}
+        gids.update(int(n) for n in os.listdir(os.path.join(DATA_DIR,"guilds")) if n.isdigit())
     except FileNotFoundError: pass
-    except: pass
+    return sorted(gids)
+
+def load_owned_partitions():
+    """로그인 전에 이 프로세스가 맡은 길드의 파티션을 모두 읽음(진행중 타이머 복구 포함)."""
+    if not PARTITION_BY_GUILD:
+        get_partition(None); return
+    for gid in stored_guild_ids():
+        if owns_guild(gid): get_partition(gid)
+
+# ---------------- 내보내기 ----------------
+def _iter_snapshot_sessions(path: str) -> Iterator[Tuple[int, float, float]]:
+    """records.json을 유저 1명(= 1줄)씩 읽어 (uid, start, end)로. 예전 형식 파일만 통째로 읽음."""
+    try: f=open(path,"r",encoding="utf-8")
+    except FileNotFoundError: return
+    with f:
+        head=f.readline()
+        if '"format":"epoch"' not in head:
+            f.seek(0)
+            try: raw=json.load(f)
+            except ValueError: return
+            if "records" in raw: raw=raw["records"]
+            for k,lst in raw.items():
+                for a,z in lst: yield int(k),epoch_from_json(a),epoch_from_json(z)
+            return
+        for line in f:
+            line=line.strip().rstrip(",")
+            if not line.startswith('"'): continue   # 마지막 "}}"
+            k,_,flat=line.partition(":")
+            try: uid=int(json.loads(k)); vals=json.loads(flat)
+            except ValueError: continue
+            for n in range(0,len(vals)-1,2): yield uid,vals[n],vals[n+1]
+
+def _iter_journal_sessions(path: str) -> Iterator[Tuple[int, float, float]]:
+    try: f=open(path,"r",encoding="utf-8")
+    except FileNotFoundError: return
+    with f:
+        for line in f:
+            try:
+                row=json.loads(line)
+                yield int(row["uid"]),epoch_from_json(row["s"]),epoch_from_json(row["e"])
+            except Exception:
+                continue
+
+def iter_partition_sessions(part: Partition, rs: Optional[datetime]=None, re: Optional[datetime]=None,
+                            uid: Optional[int]=None) -> Iterator[Tuple[int, float, float]]:
+    """파티션에 저장된 세션(보관 조각 → 스냅샷+저널 또는 SQLite)을 (uid, start, end)로 하나씩.
+    메모리의 기록이 아니라 디스크 파일에서 바로 읽으므로 저장 스레드 밖 어디서든(오프라인 포함) 쓸 수 있음."""
+    lo=rs.timestamp() if rs is not None else float("-inf")
+    hi=re.timestamp() if re is not None else float("inf")
+    def keep(u:int, a:float, z:float)->bool:
+        return (uid is None or u==uid) and z>lo and a<hi
+    yield from iter_archived_sessions(part.archive_dir, rs, re, uid)
+    if USE_SQLITE:
+        db=os.path.join(part.dir,"records.db")
+        if not os.path.exists(db): return
+        conn=sqlite3.connect(f"file:{db}?mode=ro", uri=True)   # 이 스레드 전용 읽기 연결
+        try:
+            sql="SELECT uid,start,end FROM sessions WHERE end>? AND start<?"; args: List=[lo,hi]
+            if uid is not None:
+                sql+=" AND uid=?"; args.append(uid)
+            yield from conn.execute(sql+" ORDER BY uid,start",args)
+        finally:
+            conn.close()
+        return
+    # 저널은 컴팩션 전까지만 쌓이므로 작음 → 먼저 읽어 두고 스냅샷과 겹치는 줄은 버림
+    journal: Dict[Tuple[int,float],float]={}
+    for u,a,z in _iter_journal_sessions(part.records_log):
+        journal[(u,a)]=z
+    for u,a,z in _iter_snapshot_sessions(part.records_json):
+        journal.pop((u,a),None)
+        if keep(u,a,z): yield u,a,z
+    for (u,a),z in journal.items():
+        if keep(u,a,z): yield u,a,z
+
+def stored_partitions(guild_id: Optional[int] = None) -> List[Partition]:
+    """내보내기 대상 파티션. 아직 읽지 않은 파티션은 파일 경로만 가진 객체로 만듦(기록을 올리지 않음)."""
+    if guild_id is not None or not PARTITION_BY_GUILD:
+        keys=[partition_key(guild_id)]
+    else:
+        keys=stored_guild_ids() or [partition_key(None)]
+    return [partitions.get(k) or Partition(k, partition_dir(k)) for k in keys]
+
+def export_lines(rows: Iterable[Tuple[Optional[int], int, float, float]], fmt: str) -> Iterator[str]:
+    """(guild_id, uid, start, end) → CSV/JSONL 한 줄씩. 시각은 로컬 ISO 8601."""
+    def iso(t:float)->str: return datetime.fromtimestamp(t).astimezone().isoformat(timespec="seconds")
+    if fmt=="csv":
+        yield "guild_id,uid,start,end,seconds\n"
+        for gid,u,a,z in rows:
+            yield f"{gid or ''},{u},{iso(a)},{iso(z)},{round(z-a,3)}\n"
+    else:
+        for gid,u,a,z in rows:
+            yield json.dumps({"guild_id":gid,"uid":u,"start":iso(a),"end":iso(z),"seconds":round(z-a,3)})+"\n"
+
+def write_export(lines: Iterable[str], path: str, compress: str = "auto") -> str:
+    """줄 생성기를 파일로 흘려 씀. auto면 EXPORT_GZIP_BYTES를 넘는 순간 지금까지 쓴 부분을
+    gzip으로 옮기고 나머지도 이어서 압축. 실제로 쓴 경로(.gz가 붙을 수 있음)를 돌려줌."""
+    if compress=="always":
+        with gzip.open(path+".gz","wt",encoding="utf-8",newline="") as gz:
+            for line in lines: gz.write(line)
+        return path+".gz"
+    written=0
+    lines=iter(lines)
+    with open(path,"w",encoding="utf-8",newline="") as f:
+        for line in lines:
+            f.write(line); written+=len(line)
+            if compress=="auto" and written>=EXPORT_GZIP_BYTES:
+                break
+        else:
+            return path
+    with open(path,"r",encoding="utf-8",newline="") as src, gzip.open(path+".gz","wt",encoding="utf-8",newline="") as gz:
+        shutil.copyfileobj(src,gz)
+        for line in lines: gz.write(line)
+    os.remove(path)
+    return path+".gz"
+
+def export_sessions(parts: List[Partition], out: str, fmt: str = "csv", rs: Optional[datetime] = None,
+                    re: Optional[datetime] = None, uid: Optional[int] = None, compress: str = "auto",
+                    guild_id: Optional[int] = None) -> Tuple[str, int]:
+    """파티션들의 세션을 out 파일(또는 "-" = 표준출력)로 내보냄. 블로킹 → 이벤트 루프에서는 executor로.
+    분할하지 않는 모드에서는 guild_id를 주면 guild_id 열을 그 값으로 채움. (경로, 세션 수)를 돌려줌."""
+    persist.flush(10)   # 대기 중인 저장을 먼저 디스크에
+    count=0
+    def rows():
+        nonlocal count
+        for part in parts:
+            gid=part.key if PARTITION_BY_GUILD else guild_id
+            for u,a,z in iter_partition_sessions(part,rs,re,uid):
+                count+=1
+                yield gid,u,a,z
+    lines=export_lines(rows(),fmt)
+    if out=="-":
+        for line in lines: sys.stdout.write(line)
+        sys.stdout.flush()
+        return out,count
+    return write_export(lines,out,compress),count
+
+def whole_server_exportable(guild_id: int) -> bool:
+    """분할하지 않으면 파티션 0에 모든 길드의 기록이 섞여 있음 → 이 길드 하나만 쓰는 봇일 때만 서버 전체 내보내기 허용."""
+    if PARTITION_BY_GUILD: return True
+    return LEGACY_GUILD_ID==guild_id and all(g.id==guild_id for g in bot.guilds)
+
+def export_cli(argv: List[str]) -> int:
+    """python bot.py export ... — 디스코드 접속 없이 DATA_DIR의 파일에서 바로 내보냄."""
+    ap=argparse.ArgumentParser(prog="bot.py export", description="세션 기록을 CSV/JSONL로 내보냄")
+    ap.add_argument("--guild", type=int, help="이 길드만 (길드별 분할 모드에서)")
+    ap.add_argument("--user", type=int, help="이 유저만")
+    ap.add_argument("--from", dest="date_from", help="시작 날짜 YYYY-MM-DD (로컬, 포함)")
+    ap.add_argument("--to", dest="date_to", help="끝 날짜 YYYY-MM-DD (로컬, 포함)")
+    ap.add_argument("--format", choices=["csv","jsonl"], default="csv")
+    ap.add_argument("--out", default="-", help="출력 파일 (기본: 표준출력)")
+    ap.add_argument("--gzip", choices=["auto","always","never"], default="auto")
+    a=ap.parse_args(argv)
+    def day(s:str)->datetime: return datetime.strptime(s,"%Y-%m-%d").astimezone()
+    rs=day(a.date_from) if a.date_from else None
+    re=day(a.date_to)+timedelta(days=1) if a.date_to else None
+    path,n=export_sessions(stored_partitions(a.guild), a.out, a.format, rs, re, a.user, a.gzip)
+    print(f"📤 내보내기 완료: 세션 {n}개 → {path}", file=sys.stderr)
+    return 0
 
 # ---------------- 디스코드 클라이언트 ----------------
 intents = discord.Intents.default()
 intents.voice_states = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None)
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
 
-# 진행중/기록
-timers: Dict[int, Dict] = {}
-records: Dict[int, List[Tuple[datetime, datetime]]] = {}
+# 진행중 타이머 { (파티션 키, uid): 상태 } — 기록은 파티션별 Partition.records/rollup
+timers: Dict[Tuple[int, int], Dict] = {}
 
 # ---------------- UI ----------------
 def make_embed(mention: str, start_utc: datetime, now_utc: datetime, running: bool, avatar: Optional[str] = None):
@@ -173,8 +1389,9 @@ def make_embed(mention: str, start_utc: datetime, now_utc: datetime, running: bo
 
 
 async def get_log_channel(guild:discord.Guild):
-    if STREAM_LOG_CHANNEL_ID:
-        ch = guild.get_channel(STREAM_LOG_CHANNEL_ID)
+    cid = STREAM_LOG_CHANNELS.get(guild.id, STREAM_LOG_CHANNEL_ID)
+    if cid:
+        ch = guild.get_channel(cid)
         if ch: return ch
     if guild.system_channel: return guild.system_channel
     for ch in guild.text_channels:
@@ -192,168 +1409,681 @@ async def start_tracking(member: discord.Member):
         return
 
     uid = member.id
-    if uid in timers:
+    part = get_partition(member.guild.id)
+    key = (part.key, uid)
+    st = timers.get(key)
+    if st and st.get("paused_at") and not st.get("closing") and pause_expired(st, datetime.now(timezone.utc)):
+        # 유예 시간을 넘겨 끊겨 있던 타이머(종료가 밀렸거나 놓침)는 이어 붙이지 않고 끊긴 시각으로 닫은 뒤 새로 시작
+        await close_timer(key, "자동 종료(유예 초과)", end_at=st["paused_at"], guild=member.guild)
+        st = timers.get(key)
+    if st:
+        if st.get("paused_at") and not st.get("closing"):
+            # 유예 시간 안에 다시 켜짐 → 같은 타이머/메시지로 계속
+            st["paused_at"] = None
+            close_wheel.cancel(key)
+            metrics.inc("studybot_stream_flaps_total", result="resumed")
+            save_running(part)
+            print(f"⏯️ 화면공유 재개(같은 기록 유지): uid={uid}")
         return
 
     start = datetime.now(timezone.utc)
     mention = member.mention
     avatar = str(member.display_avatar.url)
 
-    timers[uid] = {
+    timers[key] = {
         "start": start,
         "message": None,
         "message_id": None,
         "channel_id": None,
+        "guild_id": member.guild.id,
         "mention": mention,
         "avatar": avatar,
         "closing": False,
+        "shown_min": None,   # 마지막으로 화면에 반영된 경과 분
+        "edit_task": None,
+        "paused_at": None,   # 화면공유가 끊긴 시각(유예 중일 때만)
     }
-    save_running()
+    save_running(part)
+    if LIVE_DASHBOARD:
+        # 시작 메시지 없이 다음 대시보드 갱신 때 목록에 나타남
+        print(f"▶️ Go Live 시작(대시보드): uid={uid}")
+        return
 
     ch = await get_log_channel(member.guild)
     if ch:
         try:
-            msg = await ch.send(embed=make_embed(mention, start, start, True, avatar))
-            timers[uid]["message"] = msg
-            timers[uid]["message_id"] = msg.id
-            timers[uid]["channel_id"] = msg.channel.id
+            with metrics.timer("studybot_discord_call_seconds", op="send_start"):
+                msg = await ch.send(embed=make_embed(mention, start, start, True, avatar))
+            timers[key]["message"] = msg
+            timers[key]["message_id"] = msg.id
+            timers[key]["channel_id"] = msg.channel.id
+            timers[key]["shown_min"] = 0
+            save_running(part)  # 재시작 후 메시지를 다시 찾을 수 있게 ID까지 저장
             print(f"▶️ Go Live 시작: uid={uid}, msg_id={msg.id}, ch_id={msg.channel.id}")
         except Exception as e:
+            metrics.inc("studybot_discord_failures_total", op="send_start")
             print(f"❌ 시작 메시지 전송 실패: {e}")
 
 
-async def end_tracking(member: discord.Member, reason="자동 종료"):
-    uid = member.id
-    state = timers.get(uid)
+def pause_tracking(member: discord.Member):
+    """화면공유가 끊김 → 바로 닫지 않고 유예 시간 뒤에 닫도록 휠에 올려 둠. 메시지는 건드리지 않음."""
+    part = get_partition(member.guild.id)
+    key = (part.key, member.id)
+    st = timers.get(key)
+    if not st or st.get("closing") or st.get("paused_at"):
+        return
+    st["paused_at"] = datetime.now(timezone.utc)
+    close_wheel.schedule(key, STREAM_GRACE_SECONDS)
+    save_running(part)  # 유예 중에 재시작돼도 끊긴 시각으로 닫을 수 있게
+
+
+def pause_expired(st: Dict, now: datetime) -> bool:
+    # 끊긴 지 유예 시간이 지났으면 다시 켜져도 이어 붙이지 않음
+    p = st.get("paused_at")
+    return bool(p) and (now - p).total_seconds() > STREAM_GRACE_SECONDS
+
+
+async def end_tracking(member: discord.Member, reason="자동 종료", end_at: Optional[datetime] = None):
+    """타이머 종료. end_at을 주면(끊긴 시각 등) 그 시각을 종료 시각으로 기록."""
+    await close_timer((partition_key(member.guild.id), member.id), reason, end_at, guild=member.guild)
+
+
+async def close_timer(key: Tuple[int, int], reason="자동 종료", end_at: Optional[datetime] = None,
+                      guild: Optional[discord.Guild] = None):
+    """(파티션 키, uid)로 타이머 종료. 멤버 객체 없이 타이머에 저장된 길드/멘션/아바타만 씀
+    → 음성에서 나가 멤버 캐시에서 빠진 유저(members 인텐트 없음)도 유예 뒤/재접속 때 닫을 수 있음."""
+    uid = key[1]
+    state = timers.get(key)
     if not state:
         return
+    part = partitions[key[0]]
+    close_wheel.cancel(key)
+    if guild is None and state.get("guild_id"):
+        guild = bot.get_guild(state["guild_id"])
 
     # 루프가 건드리지 못하게 플래그/레퍼런스 차단
     state["closing"] = True
     msg: Optional[discord.Message] = state.get("message")
     if msg:
         state["message"] = None  # 루프 우회
+    task = state.get("edit_task")
+    if task and not task.done():
+        # 대기 중인 진행중 편집은 취소하고, 이미 나간 요청은 끝날 때까지 기다림
+        task.cancel()
+        try: await task
+        except (asyncio.CancelledError, Exception): pass
 
     # 기본 정보
     start = state["start"]
-    mention = state.get("mention") or member.mention
-    avatar = state.get("avatar") or str(member.display_avatar.url)
-    now = datetime.now(timezone.utc)
+    mention = state.get("mention") or f"<@{uid}>"
+    avatar = state.get("avatar")
+    now = end_at or datetime.now(timezone.utc)
 
     # 기록(1분 미만 제외)
     dur = (now - start).total_seconds()
     qualify = dur >= 60
     if qualify:
-        records.setdefault(uid, []).append((start, now))
-        save_records()
+        record_session(part, uid, start.timestamp(), now.timestamp())
 
     # 대상 메시지 확보(객체가 없으면 ID로 다시 가져옴)
     try:
         if not msg and state.get("channel_id") and state.get("message_id"):
-            ch = member.guild.get_channel(state["channel_id"])
+            ch = (guild.get_channel(state["channel_id"]) if guild else None) or bot.get_channel(state["channel_id"])
             if ch:
-                msg = await ch.fetch_message(state["message_id"])
+                with metrics.timer("studybot_discord_call_seconds", op="fetch"):
+                    msg = await ch.fetch_message(state["message_id"])
     except Exception as e:
+        metrics.inc("studybot_discord_failures_total", op="fetch")
         print(f"⚠️ 종료 시 메시지 재조회 실패: {e}")
 
     # 종료 임베드로 편집(혹은 새로 전송)
     try:
         emb = make_embed(mention, start, now, running=False, avatar=avatar)
         if msg:
-            await msg.edit(embed=emb)
+            with metrics.timer("studybot_discord_call_seconds", op="edit_end"):
+                await msg.edit(embed=emb)
             print(f"⏹️ 종료 편집 완료: uid={uid}, msg_id={msg.id}")
-        else:
-            ch = await get_log_channel(member.guild)
+        elif guild is not None:
+            ch = await get_log_channel(guild)
             if ch:
-                await ch.send(embed=emb)
+                with metrics.timer("studybot_discord_call_seconds", op="send_end"):
+                    await ch.send(embed=emb)
                 print(f"⏹️ 종료 새 메시지 전송: uid={uid}, ch_id={ch.id}")
+            else:
+                print(f"⚠️ 종료 메시지를 보낼 로그 채널이 없음: uid={uid}, guild={guild.id}")
+        else:
+            print(f"⚠️ 종료 메시지/길드를 찾지 못해 기록만 저장: uid={uid}, guild={state.get('guild_id')}, msg_id={state.get('message_id')}")
     except Exception as e:
+        metrics.inc("studybot_discord_failures_total", op="end")
+        if isinstance(e, discord.HTTPException) and e.status == 429:
+            metrics.inc("studybot_rate_limit_errors_total", op="end")
         print(f"❌ 종료 편집 실패: {e}")
 
     # 테이블에서 제거 + 러닝 저장
-    timers.pop(uid, None)
-    save_running()
+    timers.pop(key, None)
+    save_running(part)
 
 
 
 # ---------------- 주기 갱신/정리 ----------------
-@tasks.loop(seconds=60)
+class ChannelBucket:
+    """채널별 편집 속도 제한(5초 창 안에 limit회). 429를 받으면 retry_after 동안 막음."""
+    __slots__=("limit","stamps","blocked_until")
+    def __init__(self, limit:int):
+        self.limit=limit; self.stamps: List[float]=[]; self.blocked_until=0.0
+
+    async def acquire(self):
+        while True:
+            now=time.monotonic()
+            self.stamps=[t for t in self.stamps if now-t<5.0]
+            wait=self.blocked_until-now
+            if wait<=0 and len(self.stamps)<self.limit:
+                self.stamps.append(now); return
+            metrics.inc("studybot_edit_throttled_total")
+            if wait<=0: wait=5.0-(now-self.stamps[0])
+            await asyncio.sleep(max(wait,0.05))
+
+    def penalize(self, retry_after:float):
+        self.blocked_until=max(self.blocked_until, time.monotonic()+retry_after)
+
+class CloseWheel:
+    """종료 대기(유예 중) 타이머 휠. 마감 시각을 1초 칸으로 묶어 두고 한 루프가 지난 칸만 꺼냄
+    → 끊길 때마다 sleep 태스크를 만들지 않고, 다시 켜지면 칸에서 빼기만 하면 됨."""
+    def __init__(self, tick: float = 1.0):
+        self.tick = tick
+        self.slots: Dict[int, set] = {}
+        self.due: Dict[Tuple[int, int], int] = {}
+
+    def __len__(self): return len(self.due)
+
+    def schedule(self, key: Tuple[int, int], delay: float):
+        self.cancel(key)
+        slot = int((time.monotonic() + delay) / self.tick) + 1
+        self.slots.setdefault(slot, set()).add(key)
+        self.due[key] = slot
+
+    def cancel(self, key: Tuple[int, int]):
+        slot = self.due.pop(key, None)
+        if slot is None: return
+        keys = self.slots.get(slot)
+        if keys is not None:
+            keys.discard(key)
+            if not keys: del self.slots[slot]
+
+    def pop_due(self) -> List[Tuple[int, int]]:
+        now_slot = int(time.monotonic() / self.tick)
+        out: List[Tuple[int, int]] = []
+        for slot in sorted(k for k in self.slots if k <= now_slot):
+            for key in self.slots.pop(slot):
+                self.due.pop(key, None); out.append(key)
+        return out
+
+close_wheel = CloseWheel()
+
+@tasks.loop(seconds=1)
+async def settle_pending_closes():
+    # 유예가 끝난 타이머를 끊긴 시각 기준으로 한꺼번에 종료 (멤버 캐시 없이 저장된 정보로)
+    # 휠에서 빠졌는데 유예를 넘긴 타이머도 같이 쓸어 담음 (복구만 된 타이머는 reconcile_timers 몫)
+    now = datetime.now(timezone.utc)
+    due = close_wheel.pop_due()
+    popped = set(due)
+    due += [k for k, st in timers.items() if k not in close_wheel.due and k not in popped
+            and not st.get("restored") and pause_expired(st, now)]
+    ends = []
+    for key in due:
+        st = timers.get(key)
+        if not st or not st.get("paused_at") or st.get("closing"):
+            continue
+        metrics.inc("studybot_stream_flaps_total", result="closed")
+        ends.append(close_timer(key, "자동 종료(스트림 종료/퇴장)", end_at=st["paused_at"]))
+    if ends:
+        await asyncio.gather(*ends, return_exceptions=True)
+
+_edit_sem: Optional[asyncio.Semaphore] = None
+_channel_buckets: Dict[int, ChannelBucket] = {}
+
+def elapsed_minutes(st:Dict, now:datetime)->int:
+    return int((now-st["start"]).total_seconds()//60)
+
+def timer_staleness(now:Optional[datetime]=None)->Dict[Tuple[int,int],float]:
+    """타이머별로 화면에 보이는 분(HH:MM)이 실제보다 늦은 시간(초). 0이면 최신."""
+    now=now or datetime.now(timezone.utc)
+    out={}
+    for key,st in timers.items():
+        if st.get("closing") or st.get("paused_at") or not st.get("message"): continue
+        cur=elapsed_minutes(st,now)
+        shown=st.get("shown_min")
+        if shown is None or shown<cur:
+            due=st["start"]+timedelta(minutes=(shown+1 if shown is not None else cur))
+            out[key]=max(0.0,(now-due).total_seconds())
+        else:
+            out[key]=0.0
+    return out
+
+async def _edit_running_embed(uid:int, st:Dict, minute:int):
+    msg=st.get("message")
+    bucket=_channel_buckets.setdefault(msg.channel.id, ChannelBucket(CHANNEL_EDITS_PER_5S))
+    # 채널 버킷을 먼저 기다리고 동시 편집 슬롯은 실제 요청 동안만 잡음
+    # → 막히거나 429로 벌점 받은 채널의 대기열이 슬롯을 차지해 다른 채널/길드 편집까지 멈추지 않게
+    await bucket.acquire()
+    async with _edit_sem:
+        if st.get("closing") or st.get("message") is not msg:
+            return
+        now=datetime.now(timezone.utc)
+        try:
+            with metrics.timer("studybot_discord_call_seconds", op="edit_running"):
+                await msg.edit(embed=make_embed(st["mention"], st["start"], now, True, st["avatar"]))
+            st["shown_min"]=max(minute, elapsed_minutes(st,now))
+        except discord.HTTPException as e:
+            metrics.inc("studybot_discord_failures_total", op="edit_running")
+            if e.status==429:
+                metrics.inc("studybot_rate_limit_errors_total", op="edit_running")
+                bucket.penalize(float(getattr(e,"retry_after",None) or 5.0))
+            print(f"⚠️ 진행중 갱신 실패 uid={uid}: {e}")
+        except Exception as e:
+            metrics.inc("studybot_discord_failures_total", op="edit_running")
+            print(f"⚠️ 진행중 갱신 실패 uid={uid}: {e}")
+
+@tasks.loop(seconds=EDIT_TICK_SECONDS)
 async def update_timer_embeds():
+    # 각 타이머는 표시되는 HH:MM이 바뀌는 순간에만 편집 → 시작 초에 따라 1분 안에 자연스럽게 분산
+    global _edit_sem
     if not timers:
         return
+    if _edit_sem is None:
+        _edit_sem = asyncio.Semaphore(EDIT_CONCURRENCY)
     now = datetime.now(timezone.utc)
-    for uid, st in list(timers.items()):
-        if st.get("closing"):
-            continue  # 종료 처리 중이면 건너뜀
-        msg = st.get("message")
-        if msg:
+    for (_, uid), st in list(timers.items()):
+        if st.get("closing") or st.get("paused_at") or not st.get("message"):
+            continue  # 종료 처리 중이거나 끊겨서 유예 중이면 건너뜀
+        task = st.get("edit_task")
+        if task and not task.done():
+            continue  # 이전 편집이 아직 대기/진행 중
+        minute = elapsed_minutes(st, now)
+        if st.get("shown_min") == minute:
+            continue  # 화면 값이 그대로면 편집하지 않음
+        st["edit_task"] = asyncio.create_task(_edit_running_embed(uid, st, minute))
+    stale = {u: v for u, v in timer_staleness(now).items() if v >= 60}
+    if stale:
+        print(f"🐢 진행중 갱신 지연: " + ", ".join(f"uid={u} {v:.0f}s" for (_, u), v in stale.items()))
+
+
+# ---------------- 대시보드 ----------------
+# 로그 채널별 고정 메시지 { 채널ID: {"part": 파티션 키, "guild_id", "message_id", "message", "shown": 마지막으로 보낸 임베드} }
+dashboards: Dict[int, Dict] = {}
+DASHBOARD_MAX_EMBEDS = 10        # 메시지 하나에 넣을 수 있는 임베드 수
+DASHBOARD_LINES_PER_EMBED = 25
+DASHBOARD_MAX_CHARS = 5800       # 메시지 전체 임베드 글자 수 한도(6000) 안쪽
+
+def load_dashboards(part: Partition):
+    try:
+        with open(part.dashboard_json,"r",encoding="utf-8") as f: raw=json.load(f)
+    except FileNotFoundError: return
+    except Exception as e:
+        print(f"⚠️ 대시보드 정보 읽기 실패({part.dashboard_json}): {e}"); return
+    for cid,d in raw.items():
+        dashboards[int(cid)]={"part":part.key, "guild_id":d.get("guild_id"), "message_id":d.get("message_id"),
+                              "message":None, "shown":None}
+
+def save_dashboards(part: Partition):
+    out={str(cid):{"guild_id":d["guild_id"], "message_id":d["message_id"]}
+         for cid,d in dashboards.items() if d["part"]==part.key and d.get("message_id")}
+    persist.submit(f"dashboard:{part.key}", lambda: _atomic_write_json(part.dashboard_json,out))
+
+def dashboard_embeds(states: List[Dict], now: datetime) -> List[discord.Embed]:
+    """진행중 타이머 목록을 임베드 여러 개로 나눔(임베드당 25줄, 메시지 한도 안에서). 넘치면 마지막 줄을 '외 N명'으로.
+    경과는 분 단위라 같은 분 안에서는 내용이 그대로 → 편집하지 않음."""
+    KST = timezone(timedelta(hours=9))
+    if not states:
+        return [discord.Embed(title="⏱️ 진행중 타이머", description="진행 중인 타이머가 없습니다.", color=0x95a5a6)]
+    lines=[]
+    for st in sorted(states, key=lambda st: st["start"]):
+        h,m,_=hms_from_seconds((live_end(st,now)-st["start"]).total_seconds())
+        line=f"{st['mention']} · {st['start'].astimezone(KST).strftime('%H:%M')} 시작 · **{h:02d}:{m:02d}**"
+        if st.get("paused_at"): line+=" · ⏸️ 끊김"
+        lines.append(line)
+    title=f"⏱️ 진행중 타이머 {len(lines)}명"
+    chunks: List[List[str]]=[]
+    used=len(title)
+    shown=0
+    for line in lines:
+        if used+len(line)+1>DASHBOARD_MAX_CHARS: break
+        if not chunks or len(chunks[-1])>=DASHBOARD_LINES_PER_EMBED:
+            if len(chunks)>=DASHBOARD_MAX_EMBEDS: break
+            chunks.append([])
+        chunks[-1].append(line); used+=len(line)+1; shown+=1
+    if shown<len(lines):
+        chunks[-1][-1]=f"… 외 {len(lines)-shown+1}명"
+    embeds=[discord.Embed(description="\n".join(c), color=0x2ecc71) for c in chunks]
+    embeds[0].title=title
+    embeds[-1].set_footer(text="⏱️ 1분 단위 자동 갱신 · 종료하면 개인 기록이 따로 올라옵니다")
+    return embeds
+
+async def _update_dashboard(guild: discord.Guild, ch, embeds: List[discord.Embed], has_timers: bool):
+    d=dashboards.get(ch.id)
+    shown=[e.to_dict() for e in embeds]
+    if d is None and not has_timers: return      # 한 번도 만든 적 없으면 타이머가 생길 때 만듦
+    if d is not None and d.get("shown")==shown: return
+    bucket=_channel_buckets.setdefault(ch.id, ChannelBucket(CHANNEL_EDITS_PER_5S))
+    await bucket.acquire()
+    part=get_partition(guild.id)
+    try:
+        msg=None
+        if d is not None:
+            msg=d.get("message")
+            if msg is None and d.get("message_id") and hasattr(ch,"get_partial_message"):
+                msg=ch.get_partial_message(d["message_id"])  # 재시작 후: API 호출 없이 ID로 붙임
+        if msg is not None:
             try:
-                await msg.edit(embed=make_embed(st["mention"], st["start"], now, True, st["avatar"]))
+                with metrics.timer("studybot_discord_call_seconds", op="dashboard_edit"):
+                    await msg.edit(embeds=embeds)
+            except discord.NotFound:
+                msg=None  # 누가 지웠으면 새로 만듦
+        if msg is None:
+            with metrics.timer("studybot_discord_call_seconds", op="dashboard_send"):
+                msg=await ch.send(embeds=embeds)
+            try:
+                await msg.pin()
             except Exception as e:
-                print(f"⚠️ 진행중 갱신 실패 uid={uid}: {e}")
-
+                print(f"⚠️ 대시보드 고정 실패(메시지 관리 권한 필요): {e}")
+            d=dashboards[ch.id]={"part":part.key, "guild_id":guild.id, "message_id":msg.id}
+            save_dashboards(part)
+            print(f"📌 대시보드 생성: guild={guild.id}, ch_id={ch.id}, msg_id={msg.id}")
+        d["message"]=msg; d["shown"]=shown
+    except discord.HTTPException as e:
+        metrics.inc("studybot_discord_failures_total", op="dashboard")
+        if e.status==429:
+            metrics.inc("studybot_rate_limit_errors_total", op="dashboard")
+            bucket.penalize(float(getattr(e,"retry_after",None) or 5.0))
+        print(f"⚠️ 대시보드 갱신 실패 ch_id={ch.id}: {e}")
+    except Exception as e:
+        metrics.inc("studybot_discord_failures_total", op="dashboard")
+        print(f"⚠️ 대시보드 갱신 실패 ch_id={ch.id}: {e}")
+
+@tasks.loop(seconds=DASHBOARD_INTERVAL_SECONDS)
+async def refresh_dashboards():
+    # 길드마다 로그 채널의 대시보드를 내용이 바뀌었을 때만 한 번 편집 → 인원과 상관없이 주기당 채널 수만큼만 호출
+    now=datetime.now(timezone.utc)
+    by_guild: Dict[int, List[Dict]]={}
+    for st in timers.values():
+        if st.get("closing") or not st.get("guild_id"): continue
+        by_guild.setdefault(st["guild_id"],[]).append(st)
+    jobs=[]
+    for gid in set(by_guild) | {d["guild_id"] for d in dashboards.values() if d.get("guild_id")}:
+        guild=bot.get_guild(gid)
+        if guild is None or not owns_guild(gid): continue
+        ch=await get_log_channel(guild)
+        if ch is None: continue
+        states=by_guild.get(gid,[])
+        jobs.append(_update_dashboard(guild, ch, dashboard_embeds(states, now), bool(states)))
+    if jobs:
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+def prune_records(part: Partition, cutoff: datetime) -> Tuple[int, int]:
+    """cutoff 이전 기록을 메모리(또는 DB)에서 빼고, 빠진 구간은 압축 보관으로 넘김."""
+    part.version+=1; part.prune_version+=1  # 지난 기간 캐시까지 모두 버림
+    if part.sql:
+        cold: List[Tuple[int,float,float]]=[]
+        removed,trimmed=part.sql.prune_before(cutoff, cold)
+        part.board.remove_sessions(cold)
+        return removed,trimmed
+    removed=trimmed=0
+    c=cutoff.timestamp()
+    cold: List[Tuple[int,float,float]]=[]
+    for uid,idx in list(part.records.items()):
+        out: List[Tuple[float,float]]=[]
+        r,t=idx.prune_before(c, out)
+        removed+=r; trimmed+=t
+        cold.extend((uid,s,e) for s,e in out)
+    part.board.remove_sessions(cold)
+    if cold:
+        # 스냅샷보다 먼저 제출 → 저장 스레드가 순서대로 처리하므로 보관이 끝난 뒤에 기록에서 사라짐
+        persist.submit(f"archive:{time.monotonic_ns()}", lambda: write_archive(part.archive_dir, cold))
+    return removed,trimmed
+
+def run_prune(part: Partition, cutoff: datetime) -> Tuple[int, int]:
+    """정리 본체: cutoff 이전 기록 제거 + 롤업 정리 + 스냅샷 저장."""
+    removed,trimmed=prune_records(part, cutoff)
+    prune_rollup(part, cutoff)
+    if removed or trimmed: save_records(part)
+    return removed,trimmed
+
+def next_prune_at(now_local: Optional[datetime] = None) -> datetime:
+    """다음 화요일 04:00(로컬). 지금이 정확히 그 시각이면 다음 주."""
+    now_local = now_local or datetime.now().astimezone()
+    tue = (now_local + timedelta(days=(1 - now_local.weekday()) % 7)).replace(hour=4, minute=0, second=0, microsecond=0)
+    return tue if tue > now_local else tue + timedelta(days=7)
 
 _last_prune_marker: Optional[str] = None
-@tasks.loop(minutes=1)
+@tasks.loop(seconds=0)
 async def auto_prune_every_tue_4am():
+    # 매분 깨어나 확인하지 않고, 다음 정리 시각까지 한 번에 잠듦
     global _last_prune_marker
-    now = datetime.now().astimezone()
-    if not (now.weekday()==1 and now.hour==4 and now.minute==0): return
-    today_key=now.strftime("%Y-%m-%d")
+    when = next_prune_at()
+    print(f"🗓️ 다음 기록 정리: {when.strftime('%Y-%m-%d %H:%M')}")
+    await discord.utils.sleep_until(when)
+    today_key=when.strftime("%Y-%m-%d")
     if _last_prune_marker==today_key: return
     cutoff=keep_from_monday_after_3_weeks_ago_sunday_local()
     removed=trimmed=0
-    for uid,sess in list(records.items()):
-        new=[]
-        for s_utc,e_utc in sess:
-            s=s_utc.astimezone(); e=e_utc.astimezone()
-            if e<=cutoff: removed+=1; continue
-            if s<cutoff<e:
-                new.append((cutoff.astimezone(timezone.utc), e_utc)); trimmed+=1
-            else:
-                new.append((s_utc,e_utc))
-        records[uid]=new
+    for part in list(partitions.values()):
+        r,t=run_prune(part, cutoff)
+        removed+=r; trimmed+=t
     _last_prune_marker=today_key
-    if removed or trimmed: save_records()
+    print(f"🧹 기록 정리: 보관 {removed}개, 자름 {trimmed}개")
+
+@tasks.loop(seconds=RUNNING_HEARTBEAT_SECONDS)
+async def heartbeat_running():
+    # 진행중 타이머가 있는 파티션의 seen_at을 주기적으로 갱신 (봇이 꺼진 사이 끝난 타이머를 닫을 시각)
+    for part in list(partitions.values()):
+        if any(k==part.key and not st.get("paused_at") for (k,_),st in timers.items()):
+            save_running(part)
+
+@tasks.loop(minutes=10)
+async def compact_records_log():
+    # 저널이 일정 크기를 넘은 파티션만 스냅샷으로 접어 넣음
+    for part in list(partitions.values()):
+        if records_log_size(part) >= COMPACT_LOG_BYTES:
+            save_records(part)
+
+@tasks.loop(seconds=30)
+async def refresh_autotrack():
+    # 샤드 프로세스끼리 자동기록 스위치를 공유: 다른 프로세스가 바꾼 값을 주기적으로 다시 읽음
+    if not persist.flush(0):
+        return  # 내 쓰기가 아직 대기 중이면 다음 차례에
+    if not USE_SQLITE:
+        try:
+            if os.path.getmtime(AUTOTRACK_JSON) == _autotrack_mtime: return
+        except OSError:
+            return
+    load_autotrack()
 
-# ---------------- 이벤트 ----------------
-@bot.event
-async def on_ready():
-    print(f"✅ 로그인: {bot.user}")
+# ---------------- 지표 노출 ----------------
+def stored_sessions() -> int:
+    total=0
+    for part in list(partitions.values()):
+        if part.sql:
+            total+=part.sql.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        else:
+            total+=sum(len(idx) for idx in part.records.values())
+    return total
 
-    # 기록/진행중 복구
-    load_records()
-    load_running_partial()
-    load_autotrack()
+metrics.gauge("studybot_active_timers", lambda: len(timers))
+metrics.gauge("studybot_stored_sessions", stored_sessions)
+metrics.gauge("studybot_partitions", lambda: len(partitions))
+metrics.gauge("studybot_result_cache_entries", lambda: len(result_cache))
+metrics.gauge("studybot_pending_closes", lambda: len(close_wheel))
+metrics.gauge("studybot_persist_backlog", lambda: persist.backlog())
+metrics.gauge("studybot_persist_writes", lambda: persist.writes)
+metrics.gauge("studybot_timer_staleness_max_seconds", lambda: max(timer_staleness().values(), default=0.0))
+metrics.gauge("studybot_gateway_latency_seconds", lambda: bot.latency)
+metrics.gauge("studybot_uptime_seconds", lambda: time.time()-metrics.started)
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # GET /metrics 만 처리하는 최소 HTTP 응답
+    try:
+        req=await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts=req.split()
+        if len(parts)>1 and parts[1].split(b"?")[0]==b"/metrics":
+            status, body = "200 OK", metrics.render().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")+body)
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+_metrics_server: Optional[asyncio.AbstractServer] = None
+async def start_metrics_server():
+    global _metrics_server
+    if not METRICS_PORT or _metrics_server is not None:
+        return
+    try:
+        _metrics_server = await asyncio.start_server(_serve_metrics, METRICS_HOST, METRICS_PORT)
+        print(f"📈 지표: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print(f"⚠️ 지표 서버 시작 실패: {e}")
 
-    # 주기 작업 시작
+# ---------------- 이벤트 ----------------
+def _command_tree_hash(guild: discord.abc.Snowflake) -> str:
+    payload=[]
+    for cmd in bot.tree.get_commands(guild=guild):
+        try: payload.append(cmd.to_dict(bot.tree))
+        except TypeError: payload.append(cmd.to_dict())  # 구버전 discord.py
+    raw=json.dumps(sorted(payload,key=lambda d:d.get("name","")),sort_keys=True,ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def sync_commands_if_changed():
+    """전역으로 정의한 명령을 길드마다 복사해 길드 명령으로 등록(전역 등록은 건드리지 않음).
+    길드별 명령 트리 해시가 마지막 동기화와 같으면 sync를 건너뜀(레이트리밋 절약).
+    해시는 길드가 속한 파티션 폴더의 command_sync.json에 보관."""
+    hashes: Dict[int, Dict[str, str]]={}
+    changed=set()
+    for g in bot.guilds:
+        part=get_partition(g.id)
+        synced_hash=hashes.get(part.key)
+        if synced_hash is None:
+            try:
+                with open(part.command_sync_json,"r",encoding="utf-8") as f: synced_hash=json.load(f)
+            except FileNotFoundError: synced_hash={}
+            except: synced_hash={}
+            hashes[part.key]=synced_hash
+        obj=discord.Object(id=g.id)
+        # 명령은 전역(@bot.tree.command)으로 정의돼 있으므로 길드 사본을 만든 뒤 그것을 해시/동기화
+        bot.tree.clear_commands(guild=obj)
+        bot.tree.copy_global_to(guild=obj)
+        h=_command_tree_hash(obj)
+        if synced_hash.get(str(g.id))==h:
+            print(f"⏭️ Guild sync 생략(변경 없음): {g.id} ({g.name})")
+            continue
+        try:
+            synced = await bot.tree.sync(guild=obj)
+            synced_hash[str(g.id)]=h; changed.add(part.key)
+            print(f"✅ Guild sync: {g.id} ({g.name}) → {len(synced)} cmds")
+        except Exception as e:
+            print(f"❌ Guild sync failed for {g.id} ({g.name}): {e}")
+    for key in changed:
+        path,out=partitions[key].command_sync_json,dict(hashes[key])
+        persist.submit(f"command_sync:{key}", lambda path=path,out=out: _atomic_write_json(path,out))
+
+async def reconcile_timers():
+    """재접속 후 진행중 타이머를 실제 음성 상태와 한 번에 맞춤.
+    방송 중인데 타이머가 없으면 시작, 타이머가 있는데 방송 중이 아니면 멤버 캐시 없이 끊긴 시각
+    (없으면 마지막으로 저장된 시각)으로 종료,
+    메시지 객체가 없으면 저장된 ID로 PartialMessage를 붙여 API 호출 없이 복구."""
+    streaming: Dict[Tuple[int,int], discord.Member] = {}
+    for g in bot.guilds:
+        for vc in list(g.voice_channels)+list(g.stage_channels):
+            for m in vc.members:
+                if m.voice and m.voice.self_stream:
+                    streaming[(partition_key(g.id),m.id)]=m
+    to_end: List[Tuple[Tuple[int,int], Optional[datetime]]]=[]
+    skipped=0
+    for key,st in list(timers.items()):
+        if st.get("closing"): continue
+        if key in streaming:
+            st.pop("restored",None)
+            if st.get("paused_at"):
+                # 끊겨 있던 사이 다시 켜짐 → 이어서 기록
+                st["paused_at"]=None; close_wheel.cancel(key)
+                save_running(partitions[key[0]])
+            if not st.get("message") and st.get("channel_id") and st.get("message_id"):
+                ch=bot.get_channel(st["channel_id"])
+                if ch is not None and hasattr(ch,"get_partial_message"):
+                    st["message"]=ch.get_partial_message(st["message_id"])
+            continue
+        g=bot.get_guild(st["guild_id"]) if st.get("guild_id") else None
+        if st.get("guild_id") and (g is None or g.unavailable):
+            skipped+=1; continue  # 길드 상태를 모르면(장애 등) 판단 보류
+        # 방송 중이 아님 → 멤버 캐시와 상관없이 끊긴 시각, 없으면 마지막으로 저장된 시각으로 종료
+        to_end.append((key, st.get("paused_at") or st.get("seen_at")))
+    to_start=[m for key,m in streaming.items() if key not in timers]
+    await asyncio.gather(*(close_timer(k,"자동 종료(재접속 확인)",end_at=t) for k,t in to_end),
+                         *(start_tracking(m) for m in to_start), return_exceptions=True)
+    if to_end or to_start or skipped:
+        print(f"🔄 타이머 재확인: 종료 {len(to_end)}건, 시작 {len(to_start)}건, 보류(길드 확인 불가) {skipped}건")
+
+@bot.event
+async def setup_hook():
+    # 로그인 직후 한 번만: 주기 작업 시작 (데이터는 bot.run 전에 이미 읽어 둠)
     if not update_timer_embeds.is_running():
         update_timer_embeds.start()
     if not auto_prune_every_tue_4am.is_running():
         auto_prune_every_tue_4am.start()
+    if not compact_records_log.is_running():
+        compact_records_log.start()
+    if SHARD_COUNT and not refresh_autotrack.is_running():
+        refresh_autotrack.start()
+    if LIVE_DASHBOARD and not refresh_dashboards.is_running():
+        refresh_dashboards.start()
+    await start_metrics_server()
+
+@bot.event
+async def on_ready():
+    # 재접속 때마다 다시 불림 → 메모리 상태를 덮어쓰지 않고 맞추기만 함
+    print(f"✅ 로그인: {bot.user}")
 
     # 내가 실제로 들어가 있는 길드 목록 찍기
     print("🛰️ Joined guilds:")
     for g in bot.guilds:
         print(f" - {g.id} | {g.name}")
 
+    await reconcile_timers()
+    # 유예 종료/하트비트는 복구한 타이머를 실제 음성 상태와 맞춘 뒤에 시작
+    # (먼저 돌면 길드 캐시가 비어 종료 메시지를 못 고치고, seen_at이 재시작 시각으로 덮임)
+    if STREAM_GRACE_SECONDS > 0 and not settle_pending_closes.is_running():
+        settle_pending_closes.start()
+    if RUNNING_HEARTBEAT_SECONDS > 0 and not heartbeat_running.is_running():
+        heartbeat_running.start()
+
     # ✅ 깔끔: 각 길드에만 슬래시 명령 동기화 (전역 등록은 건드리지 않음)
-    for g in bot.guilds:
-        try:
-            synced = await bot.tree.sync(guild=discord.Object(id=g.id))
-            print(f"✅ Guild sync: {g.id} ({g.name}) → {len(synced)} cmds")
-        except Exception as e:
-            print(f"❌ Guild sync failed for {g.id} ({g.name}): {e}")
+    await sync_commands_if_changed()
 
     # (참고) 전역(Global) 명령은 여기서 만지지 않음
 
 @bot.event
 async def on_voice_state_update(member:discord.Member, before:discord.VoiceState, after:discord.VoiceState):
+    metrics.inc("studybot_voice_events_total")
     b = getattr(before,"self_stream",False)
     a = getattr(after,"self_stream",False)
-    if (not b) and a and after.channel: await start_tracking(member)
+    if VOICE_TRACE_PATH:
+        persist.append(VOICE_TRACE_PATH, json.dumps({"t": round(time.time(),3), "guild": member.guild.id, "uid": member.id,
+                                                     "before": b, "after": a, "channel": after.channel is not None}))
+    if (not b) and a and after.channel:
+        with metrics.timer("studybot_voice_event_seconds", action="start"):
+            await start_tracking(member)
     elif (b and not a) or (after.channel is None):
-        if member.id in timers: await end_tracking(member, "자동 종료(스트림 종료/퇴장)")
+        if (partition_key(member.guild.id), member.id) in timers:
+            with metrics.timer("studybot_voice_event_seconds", action="end"):
+                if STREAM_GRACE_SECONDS > 0:
+                    pause_tracking(member)  # 유예 시간 안에 다시 켜지면 이어감
+                else:
+                    await end_tracking(member, "자동 종료(스트림 종료/퇴장)")
 
 # ---------------- 슬래시 명령 ----------------
 @bot.tree.command(name="일일정산", description="오늘 또는 어제의 총 기록을 보여줍니다.")
@@ -363,7 +2093,7 @@ async def cmd_daily(i:discord.Interaction, 기준:Literal["오늘","어제"]):
         s,e=yesterday_bounds_local(); label=s.strftime("%Y-%m-%d")
     else:
         s,e=today_bounds_local(); label=s.strftime("%Y-%m-%d")
-    total=sum_seconds_in_range(uid,s,e)
+    total=sum_seconds_in_single_day(get_partition(i.guild_id),uid,s)
     ebd=discord.Embed(description=f"{i.user.mention} 일일 정산", color=0x00B894)
     ebd.add_field(name="날짜", value=label, inline=True)
     ebd.add_field(name="총 시간", value=fmt_hms(total), inline=True)
@@ -381,7 +2111,7 @@ async def cmd_weekly(i: discord.Interaction, 기준: Literal["이번주", "저
     else:
         s, e = week_bounds_local_monday_to_sunday()
 
-    total = sum_seconds_in_range(uid, s, e)
+    total = sum(sum_seconds_by_days(get_partition(i.guild_id), uid, s, 7))
     label = f"{s.strftime('%Y-%m-%d')} ~ {(e - timedelta(days=1)).strftime('%Y-%m-%d')}"
 
     emb = discord.Embed(description=f"{i.user.mention} 주간 정산", color=0x0984E3)
@@ -406,29 +2136,23 @@ async def cmd_roster(i: discord.Interaction, 기준: Literal["이번주", "저
             week_start, week_end = week_bounds_local_monday_to_sunday()
         days = [week_start + timedelta(days=k) for k in range(7)]
 
-        # 대상 uid 모으기 (기록 있거나 진행중)
-        candidate_uids = set(records.keys())
-        for uid, st in timers.items():
-            if st["start"].astimezone() < week_end:
-                candidate_uids.add(uid)
-
         guild = i.guild
         def name_for(uid: int) -> str:
             m = guild.get_member(uid) if guild else None
             return m.display_name if m else f"User {uid}"
 
-        # 집계
-        for uid in candidate_uids:
-            weekly_total = sum_seconds_in_range(uid, days[0], week_end)
+        # 집계 (롤업/SQL 7칸 조회 + 진행중 겹침)
+        t0 = time.perf_counter()
+        for uid, daily in roster_daily_totals(get_partition(i.guild_id), week_start, 7).items():
+            weekly_total = sum(daily)
             if weekly_total <= 0:
                 continue
-            rows: List[Tuple[datetime, float]] = []
-            for d in days:
-                rows.append((d, sum_seconds_in_single_day(uid, d)))
+            rows: List[Tuple[datetime, float]] = list(zip(days, daily))
             per_user.append((uid, name_for(uid), weekly_total, rows))
 
         # 정렬
         per_user.sort(key=lambda x: x[2], reverse=True)
+        metrics.observe("studybot_roster_seconds", time.perf_counter() - t0)
 
         if not per_user:
             await i.followup.send("이번 주에는 기록이 없어요.")
@@ -462,12 +2186,15 @@ async def cmd_roster(i: discord.Interaction, 기준: Literal["이번주", "저
 @bot.tree.command(name="도움말", description="스터디봇 명령어 안내")
 async def cmd_help(i:discord.Interaction):
     e=discord.Embed(title="📖 도움말", color=0xFFD166)
-    e.add_field(name="측정 방법", value="스터디방에서 화면공유 시작 시, 자동으로 기록이 시작됩니다. 자동 기록 설정은 /자동기록 명령어로 변경할 수 있습니다. 화면공유가 종료되면 측정을 종료합니다. 1분 미만의 기록은 반영되지 않습니다.", inline=False)
+    e.add_field(name="측정 방법", value="스터디방에서 화면공유 시작 시, 자동으로 기록이 시작됩니다. 자동 기록 설정은 /자동기록 명령어로 변경할 수 있습니다. 화면공유가 종료되면 측정을 종료합니다(잠깐 끊겼다가 곧 다시 켜면 같은 기록으로 이어집니다). 1분 미만의 기록은 반영되지 않습니다.", inline=False)
     e.add_field(name="/일일정산", value="오늘/어제 개인 총시간", inline=False)
     e.add_field(name="/주간정산", value="이번주/저번주 개인 총시간", inline=False)
     e.add_field(name="/주간일람", value="전체 멤버의 이번주/저번주 일별 기록", inline=False)
     e.add_field(name="/자동기록", value="내 계정의 자동 기록 On/Off를 설정할 수 있습니다.", inline=False)
     e.add_field(name="/자동기록상태", value="현재 자동기록 상태 확인", inline=False)
+    e.add_field(name="/랭킹", value="오늘/이번주/이번달/전체 기록 순위 (페이지 지정 가능)", inline=False)
+    e.add_field(name="/기록내보내기", value="내 기록(관리자는 서버 전체)을 CSV/JSONL 파일로 받기", inline=False)
+    e.add_field(name="/봇상태", value="(관리자) 응답 지연/저장/레이트리밋 등 봇 성능 지표", inline=False)
     await i.response.send_message(embed=e, ephemeral=True)
 
 @bot.tree.command(name="자동기록", description="내 계정의 자동 기록 On/Off를 설정합니다.")
@@ -475,7 +2202,7 @@ async def cmd_autotrack(i: discord.Interaction, 상태: Literal["On", "Off"]):
     uid = i.user.id
     val = (상태 == "On")
     autotrack[uid] = val
-    save_autotrack()
+    save_autotrack(uid)
     text = "✅ 자동으로 기록을 시작합니다." if val else "⛔ 자동으로 기록을 시작하지 않습니다."
     emb = discord.Embed(description=f"{i.user.mention} 자동기록: **{상태}**\n{text}", color=0x2ecc71 if val else 0xe74c3c)
     emb.set_thumbnail(url=str(i.user.display_avatar.url))
@@ -491,7 +2218,116 @@ async def cmd_autotrack_status(i: discord.Interaction):
     emb.set_thumbnail(url=str(i.user.display_avatar.url))
     await i.response.send_message(embed=emb, ephemeral=True)
 
+RANK_PAGE_SIZE = 10
+
+@bot.tree.command(name="랭킹", description="오늘/이번주/이번달/전체 기록 순위를 보여줍니다.")
+@app_commands.guild_only()
+async def cmd_rank(i: discord.Interaction, 기간: Literal["오늘", "이번주", "이번달", "전체"], 페이지: app_commands.Range[int, 1, 1000] = 1):
+    kind = {"오늘": "day", "이번주": "week", "이번달": "month", "전체": "all"}[기간]
+    with metrics.timer("studybot_leaderboard_seconds", period=kind):
+        rows, total = leaderboard_page(get_partition(i.guild_id), kind, (페이지 - 1) * RANK_PAGE_SIZE, RANK_PAGE_SIZE)
+    pages = max(1, -(-total // RANK_PAGE_SIZE))
+    if not rows:
+        await i.response.send_message(f"{기간} 기록이 없어요." if total == 0 else f"페이지는 1~{pages}까지 있어요.", ephemeral=True)
+        return
+    medal = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = [f"{medal.get(rank, f'{rank}.')} <@{uid}> — {fmt_hms(secs)}" for rank, uid, secs in rows]
+    emb = discord.Embed(title=f"🏆 {기간} 랭킹", description="\n".join(lines), color=0xF39C12)
+    emb.set_footer(text=f"페이지 {페이지}/{pages} · 총 {total}명 · 진행중 기록 포함")
+    await i.response.send_message(embed=emb)
+
+@bot.tree.command(name="기록내보내기", description="세션 기록을 CSV/JSONL 파일로 내보냅니다.")
+@app_commands.guild_only()
+async def cmd_export(i: discord.Interaction, 형식: Literal["CSV", "JSONL"], 기간: Literal["이번주", "저번주", "최근30일", "전체"],
+                     대상: Literal["나", "서버 전체"] = "나"):
+    if 대상 == "서버 전체":
+        perms = getattr(i.user, "guild_permissions", None)
+        if not perms or not perms.administrator:
+            await i.response.send_message("❌ 서버 전체 내보내기는 관리자만 사용할 수 있습니다.", ephemeral=True)
+            return
+        if not whole_server_exportable(i.guild_id):
+            await i.response.send_message("❌ 이 봇은 여러 서버의 기록을 한곳에 저장하고 있어 이 서버 기록만 골라낼 수 없습니다. "
+                                          "`PARTITION_BY_GUILD=1`로 서버별 저장을 켜거나 `대상: 나`로 내보내 주세요.", ephemeral=True)
+            return
+    await i.response.defer(ephemeral=True)
+    if 기간 == "이번주":
+        rs, re = week_bounds_local_monday_to_sunday()
+    elif 기간 == "저번주":
+        rs, re = last_week_bounds_local_monday_to_sunday()
+    elif 기간 == "최근30일":
+        re = today_bounds_local()[1]; rs = re - timedelta(days=30)
+    else:
+        rs = re = None
+    uid = None if 대상 == "서버 전체" else i.user.id
+    fmt = 형식.lower()
+    tmp = tempfile.mkdtemp(prefix="studybot-export-")
+    try:
+        name = f"studybot-{i.guild_id}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+        # 파일 읽기/쓰기는 executor에서 → 이벤트 루프를 막지 않음
+        with metrics.timer("studybot_export_seconds"):
+            path, n = await asyncio.get_running_loop().run_in_executor(
+                None, export_sessions, stored_partitions(i.guild_id), os.path.join(tmp, name), fmt, rs, re, uid, "auto", None if uid else i.guild_id)
+        limit = i.guild.filesize_limit if i.guild else 10*1024*1024
+        if os.path.getsize(path) > limit:
+            await i.followup.send("❌ 파일이 너무 커서 올릴 수 없어요. 기간을 줄이거나 `python bot.py export`를 사용해 주세요.", ephemeral=True)
+            return
+        await i.followup.send(f"📤 세션 {n}개를 내보냈습니다.", file=discord.File(path), ephemeral=True)
+    except Exception as e:
+        print(f"❌ /기록내보내기 에러: {e}")
+        await i.followup.send(f"❌ 내보내기 중 에러가 생겼습니다.: {e}", ephemeral=True)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _fmt_latency(h: Histogram) -> str:
+    if not h.count: return "-"
+    def ms(v: float) -> str:
+        return "> 10s" if v == float("inf") else f"≤{v*1000:g}ms"
+    return f"p50 {ms(h.quantile(0.5))} · p95 {ms(h.quantile(0.95))} · 평균 {h.sum/h.count*1000:.1f}ms · {h.count}회"
+
+@bot.tree.command(name="봇상태", description="(관리자) 봇 성능 지표를 보여줍니다.")
+@app_commands.default_permissions(administrator=True)
+@app_commands.guild_only()
+async def cmd_status(i: discord.Interaction):
+    perms = getattr(i.user, "guild_permissions", None)
+    if not perms or not perms.administrator:
+        await i.response.send_message("❌ 관리자만 사용할 수 있습니다.", ephemeral=True)
+        return
+    e = discord.Embed(title="🩺 봇 상태", color=0x636E72)
+    e.add_field(name="진행중 타이머", value=str(len(timers)), inline=True)
+    e.add_field(name="저장된 세션", value=str(stored_sessions()), inline=True)
+    e.add_field(name="게이트웨이 지연", value=f"{bot.latency*1000:.0f}ms" if bot.latency == bot.latency else "-", inline=True)
+    e.add_field(name="음성 이벤트 처리", value=_fmt_latency(metrics.merged("studybot_voice_event_seconds")), inline=False)
+    e.add_field(name="시작 메시지 전송", value=_fmt_latency(metrics.merged("studybot_discord_call_seconds", op="send_start")), inline=False)
+    e.add_field(name="진행중 편집", value=_fmt_latency(metrics.merged("studybot_discord_call_seconds", op="edit_running")), inline=False)
+    e.add_field(name="종료 편집", value=_fmt_latency(metrics.merged("studybot_discord_call_seconds", op="edit_end")), inline=False)
+    e.add_field(name="저장(스냅샷/저널)", value=_fmt_latency(metrics.merged("studybot_persist_seconds")), inline=False)
+    e.add_field(name="주간일람 집계", value=_fmt_latency(metrics.merged("studybot_roster_seconds")), inline=False)
+    e.add_field(name="429 / 편집 실패 / 자체 대기",
+                value=f"{metrics.total('studybot_rate_limited_total'):g} / {metrics.total('studybot_discord_failures_total'):g}"
+                      f" / {metrics.total('studybot_edit_throttled_total'):g}", inline=True)
+    e.add_field(name="저장 대기 / 누적 쓰기", value=f"{persist.backlog()} / {persist.writes}", inline=True)
+    stale = max(timer_staleness().values(), default=0.0)
+    e.add_field(name="최대 갱신 지연", value=f"{stale:.0f}s", inline=True)
+    up = int(time.time() - metrics.started)
+    shards = f" · 샤드 {','.join(map(str, bot.shard_ids))}/{bot.shard_count}" if SHARD_COUNT and bot.shard_ids else ""
+    e.set_footer(text=f"가동 {up//3600}시간 {up%3600//60}분{shards}")
+    await i.response.send_message(embed=e, ephemeral=True)
+
 # ---------------- 실행 ----------------
-if not DISCORD_TOKEN:
-    raise RuntimeError("토큰 부족! 방장에게 문의해주세요.")
-bot.run(DISCORD_TOKEN)
\ No newline at end of file
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        # 오프라인 내보내기: 토큰/접속 없이 저장된 파일에서 바로
+        try:
+            sys.exit(export_cli(sys.argv[2:]))
+        finally:
+            persist.close()
+    if not DISCORD_TOKEN:
+        raise RuntimeError("토큰 부족! 방장에게 문의해주세요.")
+    # 기록/진행중 복구는 로그인 전에 딱 한 번
+    load_owned_partitions()
+    load_autotrack()
+    try:
+        bot.run(DISCORD_TOKEN)
+    finally:
+        # 종료 전에 남은 저장 작업을 모두 디스크에 씀
+        persist.close()
@@ -0,0 +1,298 @@
+# loadtest.py — 음성 이벤트 재생 부하 테스트 (디스코드 접속 없음, 로컬 가짜 API)
+# on_voice_state_update → start/pause/end_tracking, update_timer_embeds, settle_pending_closes를 실제 코드 그대로 돌리고
+# 채널 send/edit/fetch만 지연·429를 흉내 내는 가짜 객체로 바꿔 처리량/지연/API 호출/디스크 쓰기를 잰다.
+# 사용 예:
+#   python loadtest.py                                  # 50명이 한꺼번에 켜고(일부는 끊겼다 다시 켬) 70초 뒤 한꺼번에 끔
+#   python loadtest.py --users 200 --guilds 4 --hold 20 --speed 0
+#   python loadtest.py --trace voice_trace.jsonl        # 봇을 VOICE_TRACE_PATH=voice_trace.jsonl 로 돌려 남긴 기록 재생
+#   python loadtest.py --write-trace burst.jsonl        # 합성 시나리오를 파일로 남김(같은 부하를 배포 전후로 반복)
+#   python loadtest.py --dashboard                      # 대시보드 모드(LIVE_DASHBOARD=1)로 같은 부하
+# 유예 상태로 닫히지 못하고 남은 타이머가 있으면 종료코드 1
+import os, sys, json, time, random, asyncio, argparse, tempfile, itertools
+from collections import Counter
+
+def parse_args():
+    p = argparse.ArgumentParser(description="StudyBot 음성 이벤트 부하 테스트")
+    p.add_argument("--trace", help="재생할 이벤트 기록(JSONL). 없으면 합성 시나리오")
+    p.add_argument("--write-trace", help="합성 시나리오를 이 파일로 저장")
+    p.add_argument("--users", type=int, default=50, help="합성: 동시에 켜는 인원(길드마다)")
+    p.add_argument("--guilds", type=int, default=1, help="합성: 길드 수")
+    p.add_argument("--spread", type=float, default=1.0, help="합성: 켜고 끄는 몰림 구간(초)")
+    p.add_argument("--hold", type=float, default=70.0, help="합성: 켜 둔 시간(초)")
+    p.add_argument("--flap-ratio", type=float, default=0.2, help="합성: 중간에 잠깐 끊겼다 다시 켜는 비율")
+    p.add_argument("--speed", type=float, default=1.0, help="재생 배속. 0이면 기다리지 않고 순서대로 바로")
+    p.add_argument("--latency-ms", type=float, default=120.0, help="가짜 API 평균 지연")
+    p.add_argument("--jitter-ms", type=float, default=60.0, help="가짜 API 지연 흔들림(±)")
+    p.add_argument("--rate-limit", default="5/5", help="채널당 허용 호출 '횟수/초' (디스코드 메시지 라우트 기본 5/5)")
+    p.add_argument("--spurious-429", type=float, default=0.02, help="버킷과 무관하게 429를 받는 비율(공유/전역 한도)")
+    p.add_argument("--max-retries", type=int, default=3, help="429를 받으면 retry_after만큼 쉬고 다시 시도하는 횟수(discord.py처럼)")
+    p.add_argument("--grace", type=float, default=3.0, help="STREAM_GRACE_SECONDS (봇 기본 30초는 테스트가 길어짐)")
+    p.add_argument("--drain-timeout", type=float, default=120.0, help="마지막 이벤트 뒤 정리를 기다리는 최대 시간(초)")
+    p.add_argument("--dashboard", action="store_true", help="LIVE_DASHBOARD 모드(채널당 고정 메시지 하나)로 실행")
+    p.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", help="결과 JSON 저장 경로")
+    return p.parse_args()
+
+args = parse_args()
+
+# bot을 불러오기 전에 데이터 폴더/저장 방식/유예 시간을 정해야 함
+DATA_DIR = tempfile.mkdtemp(prefix="studybot-load-")
+os.environ["DATA_DIR"] = DATA_DIR
+os.environ["STORAGE_BACKEND"] = args.backend
+os.environ["STREAM_GRACE_SECONDS"] = str(args.grace)
+os.environ["METRICS_PORT"] = "0"
+if args.dashboard: os.environ["LIVE_DASHBOARD"] = "1"
+os.environ.pop("VOICE_TRACE_PATH", None)  # 재생하면서 다시 기록하지 않게
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import discord  # noqa: E402
+import bot  # noqa: E402
+
+# ---------------- 가짜 디스코드 API ----------------
+class FakeResponse:
+    # discord.HTTPException이 읽는 필드만
+    def __init__(self, status: int, reason: str):
+        self.status = status; self.reason = reason
+
+class FakeAPI:
+    """discord.py 라우트 버킷 흉내: 채널마다 window초에 limit회. 소진되면 리셋까지 줄 서서 기다림(선제 대기).
+    공유/전역 한도처럼 예고 없이 오는 429는 --spurious-429 비율로 섞고, retry_after만큼 쉬고 다시 보냄(최대 max_retries)."""
+    def __init__(self, rng: random.Random):
+        n, w = args.rate_limit.split("/")
+        self.limit = int(n); self.window = float(w)
+        self.rng = rng
+        self.stamps: dict = {}
+        self.locks: dict = {}
+        self.calls = Counter()        # 실제로 보낸 요청(429 포함)
+        self.throttled = Counter()    # 버킷 소진으로 기다린 횟수
+        self.rate_limited = Counter()
+        self.failed = Counter()
+
+    async def _slot(self, ch_id: int, op: str):
+        async with self.locks.setdefault(ch_id, asyncio.Lock()):
+            while True:
+                now = time.monotonic()
+                q = self.stamps[ch_id] = [t for t in self.stamps.get(ch_id, []) if now - t < self.window]
+                if len(q) < self.limit:
+                    q.append(now); return
+                self.throttled[op] += 1
+                await asyncio.sleep(self.window - (now - q[0]))
+
+    async def call(self, ch_id: int, op: str):
+        for attempt in range(args.max_retries + 1):
+            await self._slot(ch_id, op)
+            self.calls[op] += 1
+            lat = max(0.0, args.latency_ms + self.rng.uniform(-args.jitter_ms, args.jitter_ms)) / 1000.0
+            await asyncio.sleep(lat)
+            if self.rng.random() >= args.spurious_429:
+                return
+            self.rate_limited[op] += 1
+            retry_after = self.rng.uniform(0.5, 2.0)
+            if attempt < args.max_retries:
+                await asyncio.sleep(retry_after)
+                continue
+            self.failed[op] += 1
+            e = discord.HTTPException(FakeResponse(429, "Too Many Requests"), {"message": "You are being rate limited.", "code": 0})
+            e.retry_after = retry_after
+            raise e
+
+_ids = itertools.count(10_000)
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", embeds: list):
+        self.id = next(_ids); self.channel = channel; self.embeds = embeds
+
+    async def edit(self, embed=None, embeds=None):
+        await self.channel.api.call(self.channel.id, "edit")
+        self.embeds = embeds or [embed]
+        return self
+
+    async def pin(self):
+        await self.channel.api.call(self.channel.id, "pin")
+
+class FakeChannel:
+    def __init__(self, guild: "FakeGuild", api: FakeAPI):
+        self.id = next(_ids); self.guild = guild; self.api = api
+        self.messages: dict = {}
+
+    async def send(self, embed=None, embeds=None):
+        await self.api.call(self.id, "send")
+        m = FakeMessage(self, embeds or [embed]); self.messages[m.id] = m
+        return m
+
+    def get_partial_message(self, mid: int):
+        return self.messages[mid]
+
+    async def fetch_message(self, mid: int):
+        await self.api.call(self.id, "fetch")
+        return self.messages[mid]
+
+    def permissions_for(self, _member):
+        return discord.Permissions(send_messages=True)
+
+class FakeAvatar:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+class FakeMember:
+    def __init__(self, uid: int, guild: "FakeGuild"):
+        self.id = uid; self.guild = guild
+        self.mention = f"<@{uid}>"; self.display_name = f"user{uid}"; self.display_avatar = FakeAvatar()
+
+class FakeGuild:
+    def __init__(self, gid: int, api: FakeAPI):
+        self.id = gid; self.me = None
+        self.system_channel = FakeChannel(self, api)
+        self.text_channels = [self.system_channel]
+        self.members: dict = {}
+
+    def get_channel(self, cid: int):
+        return next((c for c in self.text_channels if c.id == cid), None)
+
+    def get_member(self, uid: int):
+        return self.members.get(uid)
+
+    def member(self, uid: int) -> FakeMember:
+        m = self.members.get(uid)
+        if m is None: m = self.members[uid] = FakeMember(uid, self)
+        return m
+
+class VoiceState:
+    def __init__(self, stream: bool, in_channel: bool):
+        self.self_stream = stream; self.channel = object() if in_channel else None
+
+# ---------------- 이벤트 기록 ----------------
+def synthetic_trace(rng: random.Random) -> list:
+    """길드마다 users명이 spread초 안에 켜고, 일부는 중간에 잠깐 끊겼다 다시 켠 뒤, hold초 뒤 한꺼번에 끔."""
+    ev = []
+    for g in range(args.guilds):
+        gid = 900_000 + g
+        for k in range(args.users):
+            uid = 1_000 + g * args.users + k
+            on = rng.uniform(0, args.spread)
+            ev.append({"t": on, "guild": gid, "uid": uid, "before": False, "after": True, "channel": True})
+            off = args.hold + rng.uniform(0, args.spread)
+            if rng.random() < args.flap_ratio:
+                cut = on + rng.uniform(0.2, 0.8) * (off - on)
+                back = cut + rng.uniform(0.3, min(2.0, args.grace * 0.8))
+                if back < off:  # 다시 켜는 것까지 마지막으로 끄기 전에 끝나야 함
+                    ev.append({"t": cut, "guild": gid, "uid": uid, "before": True, "after": False, "channel": True})
+                    ev.append({"t": back, "guild": gid, "uid": uid, "before": False, "after": True, "channel": True})
+            ev.append({"t": off, "guild": gid, "uid": uid, "before": True, "after": False, "channel": rng.random() < 0.5})
+    ev.sort(key=lambda e: e["t"])
+    return ev
+
+def load_trace(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        ev = [json.loads(line) for line in f if line.strip()]
+    ev.sort(key=lambda e: e["t"])
+    t0 = ev[0]["t"] if ev else 0.0
+    for e in ev: e["t"] -= t0
+    return ev
+
+# ---------------- 실행 ----------------
+def pct(sorted_vals: list, q: float) -> float:
+    if not sorted_vals: return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+async def replay(events: list, api: FakeAPI) -> dict:
+    guilds: dict = {}
+    bot.bot.get_guild = lambda gid: guilds.get(gid)  # 타이머에 저장된 길드 ID로 가짜 길드를 찾게
+    latencies = []
+    handlers = []
+
+    async def handle(e: dict, due: float):
+        g = guilds.get(e["guild"])
+        if g is None: g = guilds[e["guild"]] = FakeGuild(e["guild"], api)
+        member = g.member(e["uid"])
+        if not e["channel"]:
+            # members 인텐트가 없으면 discord.py는 음성에 있는 멤버만 캐시하고, 나가는 이벤트를 보내기 전에 캐시에서 뺌
+            g.members.pop(e["uid"], None)
+        await bot.on_voice_state_update(member, VoiceState(e["before"], True), VoiceState(e["after"], e["channel"]))
+        latencies.append(time.perf_counter() - due)
+
+    async def ticker(loop_fn, every: float, stop: asyncio.Event):
+        while not stop.is_set():
+            try: await loop_fn()
+            except Exception as ex: print(f"⚠️ {loop_fn.coro.__name__} 실패: {ex}")
+            try: await asyncio.wait_for(stop.wait(), every)
+            except asyncio.TimeoutError: pass
+
+    stop = asyncio.Event()
+    bg = [asyncio.create_task(ticker(bot.update_timer_embeds, bot.EDIT_TICK_SECONDS, stop)),
+          asyncio.create_task(ticker(bot.settle_pending_closes, 1.0, stop))]
+    if bot.LIVE_DASHBOARD:
+        bg.append(asyncio.create_task(ticker(bot.refresh_dashboards, bot.DASHBOARD_INTERVAL_SECONDS, stop)))
+    writes0 = bot.persist.writes
+    t0 = time.perf_counter()
+    for e in events:
+        due = t0 + (e["t"] / args.speed if args.speed > 0 else 0.0)
+        wait = due - time.perf_counter()
+        if wait > 0: await asyncio.sleep(wait)
+        # 디스코드처럼 이벤트마다 따로 태스크로 돌림 → 몰리면 서로 겹쳐서 처리됨
+        handlers.append(asyncio.create_task(handle(e, max(due, t0) if args.speed > 0 else time.perf_counter())))
+    await asyncio.gather(*handlers, return_exceptions=True)
+    handled = time.perf_counter() - t0
+
+    # 유예 중인 타이머가 닫히고 편집이 끝날 때까지
+    deadline = time.perf_counter() + args.drain_timeout
+    while (bot.timers or len(bot.close_wheel)) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.2)
+    stop.set()
+    await asyncio.gather(*bg)
+    pending = [st["edit_task"] for st in bot.timers.values() if st.get("edit_task")]
+    await asyncio.gather(*pending, return_exceptions=True)
+    total = time.perf_counter() - t0
+    await asyncio.get_running_loop().run_in_executor(None, bot.persist.flush)
+
+    latencies.sort()
+    return {
+        "events": len(events),
+        "handled_s": round(handled, 3),
+        "total_s": round(total, 3),
+        "events_per_s": round(len(events) / handled, 1) if handled > 0 else None,
+        "latency_ms": {k: round(pct(latencies, q) * 1000, 2) for k, q in (("p50", .5), ("p90", .9), ("p99", .99), ("max", 1.0))},
+        "api_calls": dict(api.calls),
+        "api_calls_total": sum(api.calls.values()),
+        "throttled": dict(api.throttled),
+        "rate_limited": dict(api.rate_limited),
+        "api_failures": dict(api.failed),
+        "disk_writes": bot.persist.writes - writes0,
+        "left_running": len(bot.timers),
+        # 정리 시간이 지나도 유예(끊김) 상태로 남은 타이머 = 닫히지 못하고 새는 타이머
+        "left_paused": sum(1 for st in bot.timers.values() if st.get("paused_at")),
+        "sessions_recorded": bot.stored_sessions(),
+    }
+
+def main() -> int:
+    rng = random.Random(args.seed)
+    events = load_trace(args.trace) if args.trace else synthetic_trace(rng)
+    if args.write_trace:
+        with open(args.write_trace, "w", encoding="utf-8") as f:
+            for e in events: f.write(json.dumps(e) + "\n")
+        print(f"📝 시나리오 저장: {args.write_trace}")
+    if not events:
+        print("재생할 이벤트가 없음"); return 1
+    span = events[-1]["t"] / args.speed if args.speed > 0 else 0.0
+    mode = "대시보드" if args.dashboard else "유저별 메시지"
+    print(f"▶️ [{mode}] 이벤트 {len(events)}개 재생 (약 {span:.0f}s + 유예 {args.grace:.0f}s), 지연 {args.latency_ms:.0f}±{args.jitter_ms:.0f}ms, 한도 {args.rate_limit}")
+    try:
+        res = asyncio.run(replay(events, FakeAPI(rng)))
+    finally:
+        bot.persist.close()
+    lat = res["latency_ms"]
+    print(f"\n처리량      {res['events_per_s']} events/s  ({res['events']}개 / {res['handled_s']}s, 정리까지 {res['total_s']}s)")
+    print(f"처리 지연   p50 {lat['p50']}ms  p90 {lat['p90']}ms  p99 {lat['p99']}ms  max {lat['max']}ms")
+    print(f"API 호출    {res['api_calls_total']}회 {res['api_calls']}")
+    print(f"            버킷 대기 {res['throttled']}  429 {res['rate_limited']}  실패 {res['api_failures']}")
+    print(f"디스크 쓰기 {res['disk_writes']}회,  기록된 세션 {res['sessions_recorded']}개,  남은 타이머 {res['left_running']}개")
+    if res["left_paused"]:
+        print(f"❌ 유예 상태로 닫히지 않은 타이머 {res['left_paused']}개")
+    if args.out:
+        res["args"] = vars(args)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 결과 저장: {args.out}")
+    return 1 if res["left_paused"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
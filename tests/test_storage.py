@@ -0,0 +1,229 @@
+# tests/test_storage.py — 저장/집계 순수 함수와 재시작 복구 테스트 (디스코드 접속 없음)
+#   python -m pytest -q
+import os, sys, json, random, tempfile
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+# bot을 불러오기 전에 데이터 폴더/저장 방식을 정해야 함 (bench.py와 같은 방식)
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="studybot-test-")
+os.environ["STORAGE_BACKEND"] = "json"
+os.environ["PERSIST_COALESCE_SECONDS"] = "0"
+os.environ["METRICS_PORT"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot  # noqa: E402
+
+T0 = datetime(2024, 3, 4, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _close_writer():
+    yield
+    bot.persist.close()
+
+
+@pytest.fixture
+def part(tmp_path):
+    """빈 폴더를 쓰는 새 파티션. 전역 partitions/timers는 건드리지 않게 테스트마다 따로."""
+    bot.timers.clear()
+    yield bot.Partition(0, str(tmp_path))
+    bot.persist.flush()
+    bot.timers.clear()
+
+
+def reload(p: "bot.Partition") -> "bot.Partition":
+    """재시작 흉내: 저장 스레드를 비운 뒤 같은 폴더를 새 파티션으로 읽음."""
+    assert bot.persist.flush(10)
+    fresh = bot.Partition(p.key, p.dir)
+    bot.load_records(fresh)
+    return fresh
+
+
+def random_sessions(rng: random.Random, n: int):
+    """겹치지 않는 세션 n개 (한 유저의 세션은 서로 겹치지 않음)."""
+    out, t = [], T0
+    for _ in range(n):
+        t += rng.uniform(0, 7200)
+        d = rng.uniform(60, 5 * 3600)
+        out.append((round(t, 3), round(t + d, 3))); t += d   # 저장 형식과 같은 ms 단위
+    return out
+
+
+def brute_sum(sessions, rs, re):
+    return sum(max(0.0, min(e, re) - max(s, rs)) for s, e in sessions)
+
+
+def snapshot(p):
+    return {u: list(idx) for u, idx in p.records.items()}
+
+
+def assert_sessions(got, want):
+    got, want = list(got), list(want)
+    assert len(got) == len(want)
+    for (s1, e1), (s2, e2) in zip(got, want):
+        assert s1 == pytest.approx(s2, abs=1e-3) and e1 == pytest.approx(e2, abs=1e-3)
+
+
+# ---------------- SessionIndex ----------------
+def test_sum_range_matches_brute_force():
+    rng = random.Random(1)
+    sessions = random_sessions(rng, 300)
+    shuffled = sessions[:]; rng.shuffle(shuffled)
+    idx = bot.SessionIndex()
+    for s, e in shuffled:   # 순서가 뒤섞여 들어와도 정렬/누적합이 유지돼야 함
+        idx.add(s, e)
+    assert list(idx) == sessions
+    lo, hi = sessions[0][0] - 3600, sessions[-1][1] + 3600
+    for _ in range(500):
+        rs = rng.uniform(lo, hi); re = rs + rng.uniform(0, 3 * 86400)
+        assert idx.sum_range(rs, re) == pytest.approx(brute_sum(sessions, rs, re), abs=1e-6)
+    # 경계가 세션 시작/끝과 정확히 맞는 경우
+    s, e = sessions[10]
+    assert idx.sum_range(s, e) == pytest.approx(e - s)
+    assert idx.sum_range(e, e + 1e-9) == 0.0
+    assert idx.sum_range(hi, hi + 86400) == 0.0
+
+
+def test_from_flat_equals_incremental():
+    sessions = random_sessions(random.Random(2), 50)
+    flat = [x for pair in sessions for x in pair]
+    a = bot.SessionIndex.from_flat(flat)
+    b = bot.SessionIndex(sessions)
+    assert list(a) == list(b) and list(a.prefix) == pytest.approx(list(b.prefix))
+    assert a.has_start(sessions[7][0]) and not a.has_start(sessions[7][0] + 0.5)
+
+
+def test_prune_before_drops_and_trims():
+    sessions = [(T0, T0 + 100), (T0 + 200, T0 + 300), (T0 + 400, T0 + 600), (T0 + 700, T0 + 800)]
+    idx = bot.SessionIndex(sessions)
+    removed_out = []
+    assert idx.prune_before(T0 + 500, removed_out) == (2, 1)
+    assert removed_out == [(T0, T0 + 100), (T0 + 200, T0 + 300), (T0 + 400, T0 + 500)]
+    assert list(idx) == [(T0 + 500, T0 + 600), (T0 + 700, T0 + 800)]
+    # 누적합도 다시 만들어져 구간 합계가 맞아야 함
+    assert idx.sum_range(T0, T0 + 1000) == pytest.approx(200)
+    assert idx.sum_range(T0 + 550, T0 + 750) == pytest.approx(100)
+    assert idx.prune_before(T0 + 500) == (0, 0)
+    assert idx.prune_before(T0 + 900) == (2, 0) and len(idx) == 0
+
+
+def test_split_by_local_day_covers_session():
+    start = bot.local_midnight(T0) + 86400 - 1800   # 로컬 자정 30분 전
+    parts = list(bot.split_by_local_day(start, start + 3600))
+    assert len(parts) == 2
+    assert [secs for _, secs in parts] == pytest.approx([1800, 1800])
+    assert parts[0][0] < parts[1][0]
+    long = list(bot.split_by_local_day(T0, T0 + 10 * 86400 + 123))
+    assert sum(secs for _, secs in long) == pytest.approx(10 * 86400 + 123)
+
+
+# ---------------- 예전 ISO 형식 / JSON → SQLite ----------------
+def iso(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat()
+
+
+def write_legacy_files(p, sessions_by_uid, running=None):
+    """분할/저널 도입 전 형식: { uid: [[ISO 시작, ISO 종료], ...] } 와 ISO 시각의 running.json."""
+    with open(p.records_json, "w", encoding="utf-8") as f:
+        json.dump({str(u): [[iso(s), iso(e)] for s, e in ss] for u, ss in sessions_by_uid.items()}, f, indent=2)
+    if running is not None:
+        with open(p.running_json, "w", encoding="utf-8") as f:
+            json.dump(running, f)
+
+
+def test_epoch_from_json_accepts_both_formats():
+    assert bot.epoch_from_json(T0 + 0.5) == T0 + 0.5
+    assert bot.epoch_from_json(iso(T0)) == T0
+    assert bot.epoch_from_json("2024-03-04T09:00:00+09:00") == T0
+
+
+def test_load_legacy_iso_records(part):
+    rng = random.Random(3)
+    data = {111: random_sessions(rng, 20), 222: random_sessions(rng, 5)}
+    write_legacy_files(part, data)
+    bot.load_records(part)
+    assert set(part.records) == {111, 222}
+    for u, ss in data.items():
+        assert_sessions(part.records[u], ss)
+    # 롤업은 파일이 없으므로 기록에서 다시 만들어짐
+    assert sum(part.rollup[111].values()) == pytest.approx(sum(e - s for s, e in data[111]))
+    # 다음 스냅샷은 epoch 형식으로 저장되고 다시 읽어도 같음
+    bot.save_records(part)
+    again = reload(part)
+    with open(part.records_json, encoding="utf-8") as f:
+        assert json.load(f)["format"] == "epoch"
+    assert snapshot(again) == snapshot(part)
+
+
+def test_migrate_legacy_json_to_sqlite(part):
+    rng = random.Random(4)
+    data = {111: random_sessions(rng, 30), 222: random_sessions(rng, 3)}
+    start = datetime.fromtimestamp(T0, timezone.utc)
+    running = {"333": {"start": start.isoformat(), "mention": "<@333>", "guild_id": 9, "channel_id": 8, "message_id": 7,
+                       "paused_at": None, "seen_at": (start + timedelta(hours=1)).isoformat()}}
+    write_legacy_files(part, data, running)
+    part.sql = bot.open_store(os.path.join(part.dir, "records.db"), part.archive_dir)
+    bot.load_records(part)
+    # 옮긴 뒤 메모리에는 남기지 않음
+    assert not part.records and not part.rollup and not bot.timers
+    rs, re = datetime.fromtimestamp(T0 - 3600, timezone.utc), datetime.fromtimestamp(T0 + 30 * 86400, timezone.utc)
+    for u, ss in data.items():
+        assert part.sql.sum_range(u, rs, re) == pytest.approx(brute_sum(ss, rs.timestamp(), re.timestamp()))
+    row = part.sql.load_running()["333"]
+    assert bot.dt_from_iso(row["start"]) == start
+    assert bot.dt_from_iso(row["seen_at"]) == start + timedelta(hours=1)
+    assert row["message_id"] == 7
+    # 두 번째 실행에서는 다시 옮기지 않음(중복 없음)
+    bot.load_records(part)
+    n = part.sql.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+    assert n == sum(len(ss) for ss in data.values())
+
+
+# ---------------- 스냅샷 + 저널 재시작 ----------------
+def test_journal_round_trip_with_torn_tail(part):
+    rng = random.Random(5)
+    before, after = random_sessions(rng, 40), random_sessions(rng, 10)
+    shift = before[-1][1] + 60 - after[0][0]
+    after = [(round(s + shift, 3), round(e + shift, 3)) for s, e in after]
+    for s, e in before:
+        bot.record_session(part, 111, s, e)
+    bot.save_records(part)                 # 스냅샷 + 저널 비우기
+    for s, e in after:
+        bot.record_session(part, 111, s, e)
+    bot.record_session(part, 222, T0, T0 + 90)
+    assert bot.persist.flush(10)
+    with open(part.records_log, encoding="utf-8") as f:
+        assert len(f.readlines()) == len(after) + 1
+    # 스냅샷에 이미 들어간 세션이 저널에 또 있고(컴팩션 중 종료), 마지막 줄은 쓰다 만 상태
+    with open(part.records_log, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"uid": 111, "s": round(before[0][0], 3), "e": round(before[0][1], 3)}) + "\n")
+        f.write('{"uid": 111, "s": 17')
+    again = reload(part)
+    assert snapshot(again) == snapshot(part)
+    for u, days in part.rollup.items():
+        assert again.rollup[u] == pytest.approx(days)
+    assert again.gen == part.gen
+    # 잘린 줄은 줄바꿈으로 마감돼 다음 추가가 그 뒤에 붙지 않음
+    with open(part.records_log, encoding="utf-8") as f:
+        assert f.read().endswith("\n")
+    bot.record_session(again, 222, T0 + 200, T0 + 260)
+    third = reload(again)
+    assert list(third.records[222]) == [(T0, T0 + 90), (T0 + 200, T0 + 260)]
+
+
+def test_rollup_rebuilt_when_gen_differs(part):
+    sessions = random_sessions(random.Random(6), 15)
+    for s, e in sessions:
+        bot.record_session(part, 111, s, e)
+    bot.save_records(part)
+    assert bot.persist.flush(10)
+    with open(part.rollup_json, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["gen"] == part.gen
+    assert reload(part).rollup[111] == pytest.approx(part.rollup[111])
+    # 스냅샷과 세대가 다른 롤업(예: 롤업 쓰기 전에 죽음)은 믿지 않고 기록에서 다시 만듦
+    with open(part.rollup_json, "w", encoding="utf-8") as f:
+        json.dump({"gen": part.gen - 1, "rollup": {"111": {"2000-01-01": 1.0}}}, f)
+    again = reload(part)
+    assert again.rollup[111] == pytest.approx(part.rollup[111])
+    assert "2000-01-01" not in again.rollup[111]